@@ -3,13 +3,12 @@ from pydantic import BaseModel, Field, EmailStr
 import uvicorn
 import asyncio
 import logging
+from contextlib import asynccontextmanager
 import pytest
 import httpx
 
 
-task_queue = asyncio.Queue()
-
-async def process_task_queue():
+async def process_task_queue(task_queue: asyncio.Queue):
     while True:
         task = await task_queue.get()
 
@@ -22,15 +21,25 @@ async def process_task_queue():
         if task_queue.empty():
             print("All tasks have been completed.")
 
-async def startup_event():
-    asyncio.create_task(process_task_queue())
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.task_queue = asyncio.Queue()
+    worker = asyncio.create_task(process_task_queue(app.state.task_queue))
+    try:
+        yield
+    finally:
+        worker.cancel()
+        try:
+            await worker
+        except asyncio.CancelledError:
+            pass
 
 async def image(file: UploadFile):
     file_size = Path(file).stat().st_size
     logger.info(f"size: {file_size}")
 
 
-app = FastAPI( on_startup=(startup_event,))
+app = FastAPI(lifespan=lifespan)
 
 logging.basicConfig(
     level=logging.INFO,
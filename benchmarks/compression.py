@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from http_suite import SCENARIOS
+from http_compression import ENCODERS, LARGE_SIZE, PREFERENCE
+
+HEAVY_USER_ORDERS = 3000
+ENDPOINTS = [
+    ("book", "/books"),
+    ("book", "/events"),
+    ("netflixhomework", "/movies"),
+    ("todo", "/tasks/"),
+    ("homework0606", "/get_user?email=heavy@example.com"),
+]
+
+
+def seed_heavy_user():
+    connection = sqlite3.connect("products.db")
+    cursor = connection.execute("INSERT INTO Users (name, email) VALUES (?, ?)", ("Heavy", "heavy@example.com"))
+    connection.executemany(
+        "INSERT INTO Orders (user_id, product_name, amount, price) VALUES (?, ?, ?, ?)",
+        [(cursor.lastrowid, f"Product {i}", 1 + i % 9, 9.99) for i in range(HEAVY_USER_ORDERS)],
+    )
+    connection.commit()
+    connection.close()
+
+
+async def fetch(client, path, encoding):
+    async with client.stream("GET", path, headers={"Accept-Encoding": encoding}) as response:
+        response.raise_for_status()
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+        return response.headers.get("content-encoding", "identity"), body
+
+
+def compress_cost(body, encoding, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        compressed = ENCODERS[encoding](large=len(body) >= LARGE_SIZE).finish(body)
+    return len(compressed), (time.process_time() - start) / repeat * 1000
+
+
+async def run_app(name, paths, repeat):
+    scenario = SCENARIOS[name]()
+    app = scenario.app_module.app
+    rows = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await scenario.seed(client, random.Random(42))
+            if name == "homework0606":
+                seed_heavy_user()
+            for path in paths:
+                start = time.perf_counter()
+                _, body = await fetch(client, path, "identity")
+                handler_ms = (time.perf_counter() - start) * 1000
+                rows.append((path, "identity", len(body), len(body), 0.0, handler_ms))
+                for encoding in PREFERENCE:
+                    if encoding not in ENCODERS:
+                        continue
+                    # the middleware output is what goes on the wire; the encoder is timed on its own
+                    applied, wire = await fetch(client, path, encoding)
+                    _, cpu_ms = compress_cost(body, encoding, repeat)
+                    rows.append((path, applied, len(body), len(wire), cpu_ms, handler_ms))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes saved vs. added CPU of response compression per endpoint")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="compression-bench-"))
+    by_app = {}
+    for name, path in ENDPOINTS:
+        by_app.setdefault(name, []).append(path)
+
+    print(f"{'endpoint':<36} {'encoding':<9} {'bytes':>9} {'saved':>6} {'+cpu ms':>8} {'handler ms':>11} {'KiB saved/cpu ms':>17}")
+    for name, paths in by_app.items():
+        for path, encoding, raw, wire, cpu_ms, handler_ms in asyncio.run(run_app(name, paths, args.repeat)):
+            saved = raw - wire
+            per_ms = f"{saved / 1024 / cpu_ms:>17.1f}" if cpu_ms else f"{'-':>17}"
+            print(
+                f"{path:<36} {encoding:<9} {wire:>9} {saved / raw if raw else 0:>6.1%} "
+                f"{cpu_ms:>8.2f} {handler_ms:>11.2f} {per_ms}"
+            )
+    missing = [encoding for encoding in PREFERENCE if encoding not in ENCODERS]
+    if missing:
+        print(f"not installed, skipped: {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    main()
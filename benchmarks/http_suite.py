@@ -0,0 +1,347 @@
+import argparse
+import asyncio
+import importlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "u"))
+
+# the suite measures the handlers, not the login throttle
+os.environ.setdefault("LOGIN_USERNAME_BURST", "1000000000")
+os.environ.setdefault("LOGIN_IP_BURST", "1000000000")
+# and not the scheduled backups either
+os.environ.setdefault("DB_MAINTENANCE_INTERVAL", "0")
+
+# middlewareHW turns on INFO logging for the whole process when it is imported
+logging.getLogger("middleware_logger").setLevel(logging.WARNING)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SEED_BOOKS = 10_000
+SEED_EVENTS = 2_000
+SEED_TASKS = 5_000
+SEED_MOVIES = 5_000
+SEED_USERS = 2_000
+PHOTO_BATCH = 20
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    samples = sorted(samples)
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 3)
+
+    return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": pick(1.0)}
+
+
+class Scenario:
+    module = None
+    headers = {}
+
+    def __init__(self):
+        self.app_module = importlib.import_module(self.module)
+        self.ids = count(1_000_000)
+
+    async def seed(self, client, rng):
+        pass
+
+    def operations(self):
+        raise NotImplementedError
+
+
+class BookScenario(Scenario):
+    module = "book"
+
+    async def seed(self, client, rng):
+        book_module = self.app_module
+        for i in range(10, SEED_BOOKS + 10):
+            book_module.app.state.storage.add_book(book_module.AddBook(
+                id=i, name=f"Book {i}", author=f"Author {i % 500}", year=1900 + i % 125, number=i % 40,
+            ))
+        for i in range(10, SEED_EVENTS + 10):
+            book_module.app.state.storage.create_event(book_module.Event(
+                id=i, title=f"Event {i}", description="load test", date=datetime(2030, 1 + i % 12, 1 + i % 28),
+                location=f"City {i % 50}",
+            ))
+
+    def operations(self):
+        return [
+            (50, "get_book", lambda c, r: c.get(f"/books/{r.randrange(10, SEED_BOOKS + 10)}")),
+            (15, "search_books", lambda c, r: c.get("/books/search", params={"author": f"Author {r.randrange(500)}"})),
+            (15, "get_event", lambda c, r: c.get(f"/events/{r.randrange(10, SEED_EVENTS + 10)}")),
+            (10, "search_events", lambda c, r: c.get("/events/search", params={"location": f"City {r.randrange(50)}", "limit": 20})),
+            (10, "rsvp", lambda c, r: c.post(
+                f"/events/{r.randrange(10, SEED_EVENTS + 10)}/rsvp", params={"user_email": f"u{next(self.ids)}@example.com"},
+            )),
+        ]
+
+
+class TodoScenario(Scenario):
+    module = "todo"
+
+    async def seed(self, client, rng):
+        connection = sqlite3.connect("todo.db")
+        connection.executemany(
+            "INSERT INTO Todolist (title, description) VALUES (?, ?)",
+            [(f"Task {i}", "load test task") for i in range(SEED_TASKS)],
+        )
+        connection.commit()
+        connection.close()
+
+    def operations(self):
+        return [
+            (60, "one_task", lambda c, r: c.get("/one_task/", params={"id": r.randrange(1, SEED_TASKS + 1)})),
+            (20, "create_task", lambda c, r: c.post("/createtask/", json={"title": f"New {next(self.ids)}", "description": "d"})),
+            (15, "edit_task", lambda c, r: c.put("/edit_task/", json={
+                "id": r.randrange(1, SEED_TASKS + 1), "title": f"Edited {next(self.ids)}", "description": "d",
+            })),
+            (5, "list_tasks", lambda c, r: c.get("/tasks/")),
+        ]
+
+
+class NetflixScenario(Scenario):
+    module = "netflixhomework"
+
+    async def seed(self, client, rng):
+        connection = sqlite3.connect("netflix.db")
+        connection.executemany(
+            "INSERT INTO Movie (title, director, release_year, rating) VALUES (?, ?, ?, ?)",
+            [(f"Movie {i}", f"Director {i % 300}", 1950 + i % 75, round(rng.uniform(0, 10), 1)) for i in range(SEED_MOVIES)],
+        )
+        connection.commit()
+        connection.close()
+
+    def operations(self):
+        return [
+            (60, "get_movie", lambda c, r: c.get(f"/movies/{r.randrange(1, SEED_MOVIES + 1)}")),
+            (20, "add_movie", lambda c, r: c.post("/movies", json={
+                "title": f"New {next(self.ids)}", "director": "Someone", "release_year": 2000, "rating": 7.5,
+            })),
+            (5, "list_movies", lambda c, r: c.get("/movies")),
+            (5, "top_rated", lambda c, r: c.get("/stats/top", params={"limit": 10})),
+            (5, "director_stats", lambda c, r: c.get(f"/stats/directors/Director {r.randrange(300)}")),
+            (5, "similar", lambda c, r: c.get(f"/movies/{r.randrange(1, SEED_MOVIES + 1)}/similar")),
+        ]
+
+
+class ProductsScenario(Scenario):
+    module = "homework0606"
+
+    async def seed(self, client, rng):
+        connection = sqlite3.connect("products.db")
+        connection.executemany(
+            "INSERT INTO Users (id, name, email) VALUES (?, ?, ?)",
+            [(i, f"User {i}", f"user{i}@example.com") for i in range(1, SEED_USERS + 1)],
+        )
+        connection.executemany(
+            "INSERT INTO Orders (user_id, product_name, amount, price) VALUES (?, ?, ?, ?)",
+            [(i, f"Product {j}", 1 + j, 9.99) for i in range(1, SEED_USERS + 1) for j in range(5)],
+        )
+        connection.commit()
+        connection.close()
+
+    def operations(self):
+        return [
+            (75, "get_user", lambda c, r: c.get("/get_user", params={"email": f"user{r.randrange(1, SEED_USERS + 1)}@example.com"})),
+            (25, "create_user", lambda c, r: c.post("/create_user", json={
+                "name": "New", "email": f"new{next(self.ids)}@example.com",
+                "orders": [{"product_name": "Thing", "amount": 2, "price": 3.5}],
+            })),
+        ]
+
+
+class OAuthScenario(Scenario):
+    module = "oauthhomework"
+
+    async def seed(self, client, rng):
+        response = await client.post("/token", data={"username": "andrii", "password": "123456"})
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def operations(self):
+        return [
+            (60, "me", lambda c, r: c.get("/me", headers=self.headers)),
+            (20, "token", lambda c, r: c.post("/token", data={"username": "andrii", "password": "123456"})),
+            (20, "basic", lambda c, r: c.post("/basic", auth=("andrii", "123456"))),
+        ]
+
+
+class PingScenario(Scenario):
+    module = "fivehm"
+
+    def operations(self):
+        return [
+            (90, "index", lambda c, r: c.post(
+                f"/index/{r.randrange(100_000)}", headers={"X-Client-Version": f"1.{r.randrange(5)}.0"},
+            )),
+            (10, "index_batch", lambda c, r: c.post(
+                "/index/batch", headers={"X-Client-Version": "1.0.0"},
+                json=[{"user_id": r.randrange(100_000)} for _ in range(100)],
+            )),
+        ]
+
+
+class MiddlewareScenario(Scenario):
+    module = "middlewareHW"
+
+    def operations(self):
+        headers = {"X-Custom-Header": "bench"}
+        return [
+            (45, "root", lambda c, r: c.get("/", headers=headers)),
+            (45, "second", lambda c, r: c.get("/second", headers=headers)),
+            (10, "metrics", lambda c, r: c.get("/metrics")),
+        ]
+
+
+class PhotoScenario(Scenario):
+    module = "filehw"
+
+    async def seed(self, client, rng):
+        from PIL import Image
+
+        output = io.BytesIO()
+        Image.new("RGB", (640, 480), (120, 80, 200)).save(output, format="PNG")
+        self.photo = output.getvalue()
+
+    def operations(self):
+        return [
+            (90, "photo", lambda c, r: c.post("/photo", files={"file": ("photo.png", self.photo, "image/png")})),
+            (10, "photo_batch", lambda c, r: c.post("/photos/batch", files=[
+                ("files", (f"photo{i}.png", self.photo, "image/png")) for i in range(PHOTO_BATCH)
+            ])),
+        ]
+
+
+SCENARIOS = {
+    "book": BookScenario,
+    "todo": TodoScenario,
+    "netflixhomework": NetflixScenario,
+    "homework0606": ProductsScenario,
+    "oauthhomework": OAuthScenario,
+    "fivehm": PingScenario,
+    "middlewareHW": MiddlewareScenario,
+    "filehw": PhotoScenario,
+}
+
+
+async def run_scenario(name, requests, concurrency, seed):
+    scenario = SCENARIOS[name]()
+    app = scenario.app_module.app
+    rng = random.Random(seed)
+    operations = scenario.operations()
+    weights = [weight for weight, _, _ in operations]
+    stats = {op_name: {"latency": [], "errors": 0} for _, op_name, _ in operations}
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await scenario.seed(client, rng)
+            plan = rng.choices(operations, weights=weights, k=requests)
+            queue = iter(plan)
+
+            async def worker():
+                for _, op_name, make_request in queue:
+                    start = time.perf_counter()
+                    response = await make_request(client, rng)
+                    stats[op_name]["latency"].append(time.perf_counter() - start)
+                    if response.status_code >= 400:
+                        stats[op_name]["errors"] += 1
+                    # in-process requests never wait on a socket; yield like a real connection would,
+                    # otherwise one worker holds the loop and off-loop work cannot hand back results
+                    await asyncio.sleep(0)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+
+    all_latency = [sample for op in stats.values() for sample in op["latency"]]
+    return {
+        "requests": requests,
+        "throughput_rps": round(requests / elapsed, 1),
+        "latency_ms": percentiles(all_latency),
+        "errors": sum(op["errors"] for op in stats.values()),
+        "operations": {
+            op_name: {"count": len(op["latency"]), "errors": op["errors"], "latency_ms": percentiles(op["latency"])}
+            for op_name, op in stats.items()
+        },
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"{'app':<18} {'rps base':>10} {'rps now':>10} {'p99 base':>10} {'p99 now':>10}")
+    for name, current in results["apps"].items():
+        previous = baseline.get("apps", {}).get(name)
+        if previous is None:
+            continue
+        base_rps, now_rps = previous["throughput_rps"], current["throughput_rps"]
+        base_p99, now_p99 = previous["latency_ms"]["p99"], current["latency_ms"]["p99"]
+        flags = []
+        if now_rps < base_rps * (1 - threshold):
+            flags.append("throughput")
+        if now_p99 > base_p99 * (1 + threshold):
+            flags.append("p99")
+        if flags:
+            regressions.append((name, flags))
+        print(
+            f"{name:<18} {base_rps:>10.1f} {now_rps:>10.1f} {base_p99:>10.3f} {now_p99:>10.3f}"
+            + (f"  REGRESSION: {', '.join(flags)}" if flags else "")
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process HTTP benchmarks for every app module")
+    parser.add_argument("--apps", default=",".join(SCENARIOS), help="comma separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="baseline results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown before flagging")
+    args = parser.parse_args()
+
+    output = Path(args.output).resolve()
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    # every app keeps its sqlite files in the working directory
+    os.chdir(tempfile.mkdtemp(prefix="http-suite-"))
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        },
+        "apps": {},
+    }
+    for name in args.apps.split(","):
+        result = asyncio.run(run_scenario(name, args.requests, args.concurrency, args.seed))
+        results["apps"][name] = result
+        print(f"{name:<18} {result['throughput_rps']:>9.1f} req/s  p50 {result['latency_ms']['p50']:>8.3f} ms  "
+              f"p99 {result['latency_ms']['p99']:>8.3f} ms  errors {result['errors']}")
+
+    output.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+    print(f"results written to {output}")
+
+    if baseline is not None and compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
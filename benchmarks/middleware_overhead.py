@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import middlewareHW
+
+REQUESTS = 5000
+HEADERS = {"X-Custom-Header": "bench"}
+
+
+def build_base_http_app():
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def log_requests(request: Request, call_next):
+        middlewareHW.logger.info(f"request_method: {request.method}, url: {request.url}")
+
+        if "X-Custom-Header" not in request.headers:
+            return JSONResponse(status_code=400, content="Missing X-Custom-Header")
+
+        return await call_next(request)
+
+    @app.get("/second")
+    async def public_page():
+        return {"message": "second"}
+
+    return app
+
+
+def build_bare_app():
+    app = FastAPI()
+
+    @app.get("/second")
+    async def public_page():
+        return {"message": "second"}
+
+    return app
+
+
+async def run(app, requests=REQUESTS):
+    transport = httpx.ASGITransport(app=app)
+    timings = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(100):
+            await client.get("/second", headers=HEADERS)
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = await client.get("/second", headers=HEADERS)
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200
+    return timings
+
+
+def report(name, timings, baseline=None):
+    mean_us = statistics.fmean(timings) * 1e6
+    p99_us = sorted(timings)[int(len(timings) * 0.99)] * 1e6
+    line = f"{name:<22} mean {mean_us:8.1f} us   p99 {p99_us:8.1f} us"
+    if baseline is not None:
+        line += f"   overhead {mean_us - baseline:+8.1f} us"
+    print(line)
+    return mean_us
+
+
+async def main():
+    logging.getLogger("middleware_logger").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    bare = report("no middleware", await run(build_bare_app()))
+    report("BaseHTTPMiddleware", await run(build_base_http_app()), bare)
+    report("pure ASGI middleware", await run(middlewareHW.app), bare)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+import re
+import sys
+import timeit
+from pathlib import Path
+
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from book_models import RegisterUser
+
+ROUNDS = 20000
+PAYLOAD = {
+    "name": "Andrii",
+    "surname": "Pylypchyk",
+    "email": "andrii@example.com",
+    "password": "StrongPass1!",
+    "phone_number": "+380931234567",
+}
+
+
+class OldRegisterUser(BaseModel):
+    name: str = Field(min_length=2)
+    surname: str = Field(min_length=2)
+    email: EmailStr = Field(description="email")
+    password: str = Field(min_length=8)
+    phone_number: str = Field(pattern=r"\+?\d{10,15}")
+    model_config = ConfigDict(regex_engine="python-re")
+
+    @field_validator("password")
+    @classmethod
+    def validate_password(cls, v):
+        if len(v) < 8:
+            raise ValueError("Password must be at least 8 characters long.")
+        if not re.search(r"[a-z]", v):
+            raise ValueError("Password must contain at least one lowercase letter.")
+        if not re.search(r"[A-Z]", v):
+            raise ValueError("Password must contain at least one uppercase letter.")
+        if not re.search(r"\d", v):
+            raise ValueError("Password must contain at least one digit.")
+        if not re.search(r"[!@#$%^&*()_+=\-]", v):
+            raise ValueError("Password must contain at least one special character.")
+        return v
+
+
+class NoEmailOld(OldRegisterUser):
+    email: str
+
+
+class NoEmailNew(RegisterUser):
+    email: str
+
+
+def bench(name, model):
+    seconds = min(timeit.repeat(lambda: model.model_validate(PAYLOAD), number=ROUNDS, repeat=5))
+    per_call_us = seconds / ROUNDS * 1e6
+    print(f"{name:<34} {per_call_us:7.2f} us/validation")
+    return per_call_us
+
+
+def main():
+    # EmailStr parsing is ~95% of a full validation, so the whole model comes out about even (0.87x-1.16x
+    # over three runs on one CPU); only the rules without it get measurably cheaper (1.1x-1.6x)
+    old = bench("old RegisterUser", OldRegisterUser)
+    new = bench("new RegisterUser", RegisterUser)
+    print(f"{'old / new':<34} {old / new:7.2f}x")
+    old = bench("old RegisterUser (without email)", NoEmailOld)
+    new = bench("new RegisterUser (without email)", NoEmailNew)
+    print(f"{'old / new':<34} {old / new:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "u"))
+
+import oauthhomework
+
+ROUNDS = 20000
+USER_COUNTS = (10, 10_000, 1_000_000)
+
+
+def seed(count):
+    oauthhomework.users.clear()
+    for i in range(count):
+        oauthhomework.users[f"user{i}"] = {"name": f"user{i}", "email": f"user{i}@example.com", "password": "123456"}
+    oauthhomework.users_by_email.clear()
+    oauthhomework.users_by_email.update({user["email"]: user for user in oauthhomework.users.values()})
+    return oauthhomework.users[f"user{count - 1}"]
+
+
+async def authenticate(token):
+    email = await oauthhomework.decode_token(token)
+    return oauthhomework.users_by_email[email]
+
+
+def linear_scan(email):
+    for user in oauthhomework.users.values():
+        if user["email"] == email:
+            return user
+
+
+async def measure(func, *args, rounds=ROUNDS):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = func(*args)
+        if asyncio.iscoroutine(result):
+            await result
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+async def main():
+    print(f"{'users':>10} {'cold verify':>14} {'cached verify':>14} {'old linear scan':>16}")
+    for count in USER_COUNTS:
+        user = seed(count)
+        token = oauthhomework.create_token(user)
+
+        oauthhomework.verify_signature.cache_clear()
+        cold = 0.0
+        for _ in range(1000):
+            oauthhomework.verify_signature.cache_clear()
+            cold += await measure(authenticate, token, rounds=1)
+        cold /= 1000
+
+        warm = await measure(authenticate, token)
+        scan = await measure(linear_scan, user["email"], rounds=max(1, ROUNDS // count))
+        print(f"{count:>10} {cold:>11.2f} us {warm:>11.2f} us {scan:>13.2f} us")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+import sys
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "hw"))
+
+from websocketframes import Outgoing, encode_binary, encode_text, msgpack
+
+MESSAGES = 50_000
+BATCH_SIZES = (1, 10, 50)
+FRAME_HEADER = 4
+
+
+def make_messages():
+    return [
+        {
+            "type": "message",
+            "id": i,
+            "text": f"Клієнт #{i % 300} написав: hello number {i}",
+        }
+        for i in range(MESSAGES)
+    ]
+
+
+def old_frames(messages):
+    for message in messages:
+        yield message["text"].encode("utf-8")
+
+
+def new_frames(outgoing, batch_size, binary):
+    for start in range(0, len(outgoing), batch_size):
+        frames = outgoing[start:start + batch_size]
+        if binary:
+            yield encode_binary(frames)
+        else:
+            yield encode_text(frames).encode("utf-8")
+
+
+def run(name, frames, deflate):
+    # permessage-deflate with context takeover: one compressor per connection, sync flush per frame
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    wire_bytes = 0
+    frame_count = 0
+    start = time.process_time()
+    for frame in frames:
+        if deflate:
+            frame = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        wire_bytes += len(frame) + FRAME_HEADER
+        frame_count += 1
+    cpu_us = (time.process_time() - start) / MESSAGES * 1e6
+    print(
+        f"{name:<34} {frame_count:>7} frames {wire_bytes / MESSAGES:>8.1f} B/msg {cpu_us:>7.2f} us/msg"
+    )
+
+
+def encode_once(messages):
+    start = time.process_time()
+    outgoing = [Outgoing(message) for message in messages]
+    if msgpack is not None:
+        for frame in outgoing:
+            frame.binary()
+    cpu_us = (time.process_time() - start) / MESSAGES * 1e6
+    print(f"encoding once per broadcast (json + msgpack): {cpu_us:.2f} us/msg")
+    return outgoing
+
+
+def main():
+    messages = make_messages()
+    outgoing = encode_once(messages)
+    print(f"{MESSAGES} messages, per-connection cost")
+    for deflate in (False, True):
+        suffix = " + deflate" if deflate else ""
+        run("old text f-string" + suffix, old_frames(messages), deflate)
+        for batch_size in BATCH_SIZES:
+            run(f"json batch={batch_size}" + suffix, new_frames(outgoing, batch_size, False), deflate)
+            if msgpack is not None:
+                run(f"msgpack batch={batch_size}" + suffix, new_frames(outgoing, batch_size, True), deflate)
+    if msgpack is None:
+        print("msgpack is not installed, binary protocol skipped")
+
+
+if __name__ == "__main__":
+    main()
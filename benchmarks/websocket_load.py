@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import websockets
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+HW_DIR = Path(__file__).resolve().parent.parent / "hw"
+MARKER = re.compile(r"lt:(\d+):(\d+\.\d+)")
+PONG_FRAME = json.dumps({"type": "pong"}, separators=(",", ":"))
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 3)
+
+    return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": pick(1.0), "count": len(samples)}
+
+
+def server_rss_kb(pid):
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+async def start_server(port, workdir):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "websocketHW:app", "--app-dir", str(HW_DIR),
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir,
+        # every login comes from this one address; the limits are for clients, not the load generator
+        env={**os.environ, "LOGIN_USERNAME_BURST": "1000000000", "LOGIN_IP_BURST": "1000000000"},
+    )
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+        for _ in range(100):
+            try:
+                if (await client.get("/metrics/connections")).status_code == 200:
+                    return process
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("server did not start")
+
+
+async def login_users(base_url, count):
+    tokens = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        for i in range(count):
+            email = f"load{i}@example.com"
+            response = await client.post("/create_user", json={"email": email, "password": "loadtest"})
+            if response.status_code == 200:
+                # a new user gets its websocket token straight away, no login needed
+                tokens.append(response.json()["websocket_token"])
+                continue
+            while True:
+                response = await client.post("/token", data={"username": email, "password": "loadtest"})
+                if response.status_code != 429:
+                    break
+                # a running server keeps its per-IP login limit, so wait for the bucket to refill
+                await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+            response.raise_for_status()
+            tokens.append(response.json()["access_token"])
+    return tokens
+
+
+class Stats:
+    def __init__(self):
+        self.connect_latency = []
+        self.connect_errors = 0
+        self.delivery_latency = []
+        self.received = 0
+        self.sent = 0
+
+
+def unpack(frame):
+    if isinstance(frame, bytes):
+        frame = msgpack.unpackb(frame)
+    else:
+        frame = json.loads(frame)
+    return frame["messages"] if frame["type"] == "batch" else [frame]
+
+
+async def reader(connection, stats):
+    try:
+        async for frame in connection:
+            now = time.time()
+            for item in unpack(frame):
+                if item["type"] == "ping":
+                    await connection.send(PONG_FRAME)
+                elif item["type"] == "message":
+                    marker = MARKER.search(item["text"])
+                    if marker:
+                        stats.received += 1
+                        stats.delivery_latency.append(now - float(marker.group(2)))
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def open_connection(ws_url, client_id, token, binary, stats, semaphore):
+    subprotocols = ["msgpack"] if binary else None
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            connection = await websockets.connect(
+                f"{ws_url}/ws/{client_id}?token={token}", subprotocols=subprotocols, max_size=None
+            )
+        except (OSError, websockets.WebSocketException):
+            stats.connect_errors += 1
+            return None
+        stats.connect_latency.append(time.perf_counter() - start)
+    return connection
+
+
+async def sender(connection, rate, duration, stats, seq):
+    interval = 1 / rate
+    deadline = time.perf_counter() + duration
+    next_send = time.perf_counter()
+    while next_send < deadline:
+        await asyncio.sleep(max(0, next_send - time.perf_counter()))
+        await connection.send(f"lt:{next(seq)}:{time.time():.6f}")
+        stats.sent += 1
+        next_send += interval
+
+
+async def run(args):
+    stats = Stats()
+    workdir = tempfile.mkdtemp(prefix="websocket-load-")
+    process = None
+    server_pid = args.server_pid
+    if args.start_server:
+        process = await start_server(args.port, workdir)
+        server_pid = process.pid
+        base_url = f"http://127.0.0.1:{args.port}"
+    else:
+        base_url = args.url
+    ws_url = base_url.replace("http", "ws", 1)
+    rss = {"start": server_rss_kb(server_pid)}
+
+    try:
+        tokens = await login_users(base_url, args.users)
+        semaphore = asyncio.Semaphore(args.connect_concurrency)
+        connections = await asyncio.gather(*(
+            open_connection(ws_url, i, tokens[i % len(tokens)], args.msgpack, stats, semaphore)
+            for i in range(args.connections)
+        ))
+        connections = [c for c in connections if c is not None]
+        rss["connected"] = server_rss_kb(server_pid)
+
+        readers = [asyncio.create_task(reader(c, stats)) for c in connections]
+        senders = connections[:args.senders]
+        seq = iter(range(1, 1 << 62))
+        per_sender_rate = args.rate / max(len(senders), 1)
+        await asyncio.gather(*(sender(c, per_sender_rate, args.duration, stats, seq) for c in senders))
+        await asyncio.sleep(args.drain)
+        rss["end"] = server_rss_kb(server_pid)
+
+        for connection in connections:
+            await connection.close()
+        for task in readers:
+            task.cancel()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    expected = stats.sent * len(connections)
+    return {
+        "config": {
+            "connections": args.connections,
+            "senders": args.senders,
+            "rate": args.rate,
+            "duration": args.duration,
+            "msgpack": args.msgpack,
+        },
+        "connected": len(connections),
+        "connect_errors": stats.connect_errors,
+        "connect_latency_ms": percentiles(stats.connect_latency),
+        "messages_sent": stats.sent,
+        "deliveries_expected": expected,
+        "deliveries_received": stats.received,
+        "loss_ratio": round(1 - stats.received / expected, 6) if expected else None,
+        "delivery_latency_ms": percentiles(stats.delivery_latency),
+        "server_rss_kb": rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the hw/websocketHW.py chat")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="running server to test")
+    parser.add_argument("--start-server", action="store_true", help="start a local uvicorn server instead")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--server-pid", type=int, help="pid of a running server, for RSS sampling")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=50, help="messages per second across all senders")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--drain", type=float, default=2, help="seconds to wait for deliveries after sending")
+    parser.add_argument("--msgpack", action="store_true", help="use the msgpack subprotocol")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.msgpack and msgpack is None:
+        parser.error("--msgpack needs the msgpack package")
+
+    report = json.dumps(asyncio.run(run(args)), indent=2, sort_keys=True)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,103 +1,114 @@
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Query
 import uvicorn
-from pydantic import BaseModel, Field, EmailStr, validator, ConfigDict, field_validator
-import re
-from datetime import datetime
-
-
-app = FastAPI()
-
-class AddBook(BaseModel):
-    id: int
-    name: str = Field(..., description="Назва книги")
-    author: str = Field(..., description="Автор книги")
-    year: int
-    number: int
-
-class RegisterUser(BaseModel):
-    name: str = Field(min_length=2)
-    surname: str = Field(min_length=2)
-    email: EmailStr = Field(description="email")
-    password: str = Field(
-        min_length=8,
-        description="Має містити хоча б одну велику літеру, одну маленьку, одну цифру та один спецсимвол"
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+from book_models import AddBook, RegisterUser, Event, BulkRSVP, local_naive, with_hashed_password
+from book_storage import CapacityError, MemoryStorage, SQLiteStorage, WriteBehindCache
+from singleflight import SingleFlight
+from event_scheduler import EventScheduler
+from http_compression import CompressionMiddleware
+from loopmonitor import install_from_env
+
+
+BOOK_STORAGE = os.getenv("BOOK_STORAGE", "sqlite")
+BOOK_DB_PATH = os.getenv("BOOK_DB_PATH", "book.db")
+BOOK_CACHE = os.getenv("BOOK_CACHE") == "1"
+EVENT_ARCHIVE_INTERVAL = float(os.getenv("EVENT_ARCHIVE_INTERVAL", "60"))
+EVENT_REMINDER_MINUTES = float(os.getenv("EVENT_REMINDER_MINUTES", "60"))
+
+
+def create_storage():
+    if BOOK_STORAGE == "memory":
+        return MemoryStorage()
+    storage = SQLiteStorage(BOOK_DB_PATH)
+    if BOOK_CACHE:
+        return WriteBehindCache(storage)
+    return storage
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # built here rather than at import, so every startup gets a storage its own shutdown closes
+    storage = create_storage()
+    storage.seed(seed_books, seed_users, seed_events, seed_rsvps)
+    app.state.storage = storage
+    app.state.scheduler = EventScheduler(
+        storage, EVENT_ARCHIVE_INTERVAL, timedelta(minutes=EVENT_REMINDER_MINUTES)
     )
-    phone_number:str = Field(pattern=r"\+?\d{10,15}")
-    model_config = ConfigDict(regex_engine="python-re")
-
-    @field_validator("password")
-    @classmethod
-    def validate_password(cls, v):
-        if len(v) < 8:
-            raise ValueError("Password must be at least 8 characters long.")
-        if not re.search(r"[a-z]", v):
-            raise ValueError("Password must contain at least one lowercase letter.")
-        if not re.search(r"[A-Z]", v):
-            raise ValueError("Password must contain at least one uppercase letter.")
-        if not re.search(r"\d", v):
-            raise ValueError("Password must contain at least one digit.")
-        if not re.search(r"[!@#$%^&*()_+=\-]", v):
-            raise ValueError("Password must contain at least one special character.")
-        return v
-
-class Event(BaseModel):
-    id: int
-    title: str
-    description: str
-    date: datetime
-    location: str
-
-
-
-
-
-books = {
-    1: AddBook(id=1, name="1984", author="George Orwell", year=1949, number=12),
-    2: AddBook(id=2, name="To Kill a Mockingbird", author="Harper Lee", year=1960, number=5),
-    3: AddBook(id=3, name="The Great Gatsby", author="F. Scott Fitzgerald", year=1925, number=8),
-    4: AddBook(id=4, name="Brave New World", author="Aldous Huxley", year=1932, number=10),
-    5: AddBook(id=5, name="The Catcher in the Rye", author="J.D. Salinger", year=1951, number=7),
-}
+    await app.state.scheduler.start()
+    try:
+        yield
+    finally:
+        await app.state.scheduler.close()
+        storage.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
+book_flights = SingleFlight("get_one_book")
+event_flights = SingleFlight("get_event")
+
+
+async def call(function, *args):
+    # SQLite calls block, so they run on a thread; the in-memory storage answers faster than the hop
+    if app.state.storage.offload:
+        return await asyncio.to_thread(function, *args)
+    return function(*args)
+
+
+seed_books = [
+    AddBook(id=1, name="1984", author="George Orwell", year=1949, number=12),
+    AddBook(id=2, name="To Kill a Mockingbird", author="Harper Lee", year=1960, number=5),
+    AddBook(id=3, name="The Great Gatsby", author="F. Scott Fitzgerald", year=1925, number=8),
+    AddBook(id=4, name="Brave New World", author="Aldous Huxley", year=1932, number=10),
+    AddBook(id=5, name="The Catcher in the Rye", author="J.D. Salinger", year=1951, number=7),
+]
 
-users = {
-    "user1": RegisterUser(
+seed_users = [
+    RegisterUser(
         name="Andrii",
         surname="Pylypchyk",
         email="andrii@example.com",
         password="StrongPass1!",
         phone_number="+380931234567"
     ),
-    "user2": RegisterUser(
+    RegisterUser(
         name="Olena",
         surname="Koval",
         email="olena@example.com",
         password="Qwerty12@",
         phone_number="0937654321"
     )
-}
+]
 
 
 
-events = {
-    1: Event(
+seed_events = [
+    Event(
         id=1,
         title="Python Workshop",
         description="Навчальний воркшоп з Python для початківців",
         date=datetime(2025, 6, 15, 10, 0),
         location="Онлайн"
     ),
-    2: Event(
+    Event(
         id=2,
         title="Хакатон зі Штучного Інтелекту",
         description="48-годинний хакатон з розробки AI-рішень",
         date=datetime(2025, 7, 1, 9, 0),
         location="Київ, вул. Хакерська 1"
     )
-}
+]
 
 
 
-rsvps = {
+seed_rsvps = {
     1: ["andrii@example.com"],
     2: ["olena@example.com", "test@example.com"]
 }
@@ -106,29 +117,44 @@ rsvps = {
 
 @app.get("/books", status_code=200)
 async def get_books():
-    return list(books.values())
+    return await call(app.state.storage.list_books)
 
 @app.post("/add_book/", status_code=201)
 async def add_book(add_book: AddBook):
-    if add_book.id in books:
+    if not await call(app.state.storage.add_book, add_book):
         raise HTTPException(status_code=400, detail="Книга з таким ID вже існує")
 
-    books[add_book.id] = add_book
-    return list(books.values())
+    return await call(app.state.storage.list_books)
+
+
+@app.get("/books/search", status_code=200)
+async def search_books(
+    author: str | None = None,
+    min_year: int | None = None,
+    max_year: int | None = None,
+    min_number: int | None = None,
+    max_number: int | None = None,
+    limit: int = Query(100, gt=0, le=1000),
+):
+    return await call(app.state.storage.search_books, author, min_year, max_year, min_number, max_number, limit)
 
 
 @app.get("/books/{id}", status_code=200)
 async def get_one_book(id: int):
-    if id in books:
-        return books[id]
+    book = await book_flights.run(id, app.state.storage.get_book, id, offload=app.state.storage.offload)
+    if book is not None:
+        return book
     raise HTTPException(status_code=404, detail="Книга не знайдена")
 
 
 
 @app.post("/add_user", status_code=201)
 async def register_user(register_user: RegisterUser):
-    users[f"user{len(users)+1}"] = register_user
-    return {"message": "Користувача додано успішно", "user": register_user}
+    hashed = await asyncio.to_thread(with_hashed_password, register_user)
+    key = await call(app.state.storage.add_user, hashed)
+    if key is None:
+        raise HTTPException(status_code=409, detail="Користувач з таким email вже існує")
+    return {"message": "Користувача додано успішно", "user": {"id": key, **hashed.model_dump(exclude={"password"})}}
 
 
 
@@ -137,23 +163,54 @@ async def register_user(register_user: RegisterUser):
 async def create_event(new_event: Event, x_role: str = Header(..., alias="X-Role")):
     if x_role != "admin":
         raise HTTPException(status_code=403, detail="немає прав створювати події")
-    if new_event.id in events:
+    if not await call(app.state.storage.create_event, new_event):
         raise HTTPException(status_code=400, detail="Event exist")
-    events[new_event.id] = new_event
+    app.state.scheduler.schedule(new_event)
     return new_event
 
 
 @app.get('/events', status_code=200)
 async def get_events():
+    events = await call(app.state.storage.list_events)
     if events:
-        return list(events.values())
+        return events
     else:
         raise HTTPException(status_code=204, detail="No Content")
 
+
+@app.get('/events/search', status_code=200)
+async def search_events(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    location: str | None = None,
+    limit: int = Query(100, gt=0, le=1000),
+):
+    start = local_naive(start) if start is not None else None
+    end = local_naive(end) if end is not None else None
+    return await call(app.state.storage.search_events, start, end, location, limit)
+
+
+@app.get('/events/upcoming', status_code=200)
+async def upcoming_events(
+    days: int | None = Query(None, gt=0, description="only events in the next N days"),
+    location: str | None = None,
+    limit: int = Query(100, gt=0, le=1000),
+):
+    now = datetime.now()
+    end = now + timedelta(days=days) if days is not None else None
+    return await call(app.state.storage.search_events, now, end, location, limit)
+
+
+@app.get('/events/archive', status_code=200)
+async def archived_events(offset: int = Query(0, ge=0), limit: int = Query(100, gt=0, le=1000)):
+    return await call(app.state.storage.list_archived_events, offset, limit)
+
+
 @app.get('/events/{id}', status_code=200)
 async def get_event(id:int):
-    if id in events:
-        return events[id]
+    event = await event_flights.run(id, app.state.storage.get_event, id, offload=app.state.storage.offload)
+    if event is not None:
+        return event
     else:
         raise HTTPException(status_code=404, detail="Not found")
 
@@ -162,12 +219,15 @@ async def get_event(id:int):
 async def put_event(id: int, event: Event, x_role: str = Header(..., alias="X-Role")):
     if x_role != "admin":
         raise HTTPException(status_code=403, detail="немає прав змінювати події")
-    if id not in events:
-        raise HTTPException(status_code=404, detail="Not found")
     if event.id != id:
         raise HTTPException(status_code=400, detail="Bad Request")
-
-    events[id] = event
+    try:
+        updated = await call(app.state.storage.put_event, event)
+    except CapacityError:
+        raise HTTPException(status_code=400, detail="Місткість менша за кількість зареєстрованих")
+    if not updated:
+        raise HTTPException(status_code=404, detail="Not found")
+    app.state.scheduler.schedule(event)
     return event
 
 
@@ -175,33 +235,114 @@ async def put_event(id: int, event: Event, x_role: str = Header(..., alias="X-Ro
 async def delete_event(id: int, x_role: str = Header(..., alias="X-Role")):
     if x_role != "admin":
         raise HTTPException(status_code=403, detail="немає прав видаляти події")
-    if id not in events:
+    if not await call(app.state.storage.delete_event, id):
         raise HTTPException(status_code=404, detail="Not found")
-    del events[id]
     return {"message": "Подію видалено"}
 
 @app.patch("/events/{id}/reschedule", status_code=200)
 async def reschedule_event(id: int, new_date: datetime, x_role: str = Header(..., alias="X-Role")):
     if x_role != "admin":
         raise HTTPException(status_code=403, detail="немає прав переносити події")
-    if id not in events:
-        raise HTTPException(status_code=404, detail="Not found")
+    new_date = local_naive(new_date)
     if new_date < datetime.now():
         raise HTTPException(status_code=400, detail="Bad Request")
-    events[id].date = new_date
-    return events[id]
+    event = await call(app.state.storage.reschedule_event, id, new_date)
+    if event is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    app.state.scheduler.schedule(event)
+    return event
+
+
+async def reserve(id: int, emails: list[str]):
+    try:
+        result = await call(app.state.storage.add_rsvps, id, emails)
+    except CapacityError as e:
+        if e.places == 0:
+            raise HTTPException(status_code=409, detail="Немає вільних місць")
+        raise HTTPException(status_code=409, detail=f"Недостатньо вільних місць: {e.places}")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return result
+
+
+async def cancel(id: int, emails: list[str]):
+    result = await call(app.state.storage.cancel_rsvps, id, emails)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return result
 
 
 @app.post("/events/{id}/rsvp")
 async def rsvp_event(id: int, user_email: str):
-    if id not in events:
-        raise HTTPException(status_code=404, detail="Not found")
-    if id not in rsvps:
-        rsvps[id] = []
-    if user_email in rsvps[id]:
+    registered, attendees = await reserve(id, [user_email])
+    if not registered:
         raise HTTPException(status_code=409, detail="Користувач вже зареєстрований")
-    rsvps[id].append(user_email)
-    return {"message": "Реєстрація успішна"}
+    return {"message": "Реєстрація успішна", "attendees": attendees}
+
+
+@app.delete("/events/{id}/rsvp")
+async def cancel_rsvp(id: int, user_email: str):
+    cancelled, attendees = await cancel(id, [user_email])
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="Користувач не зареєстрований")
+    return {"message": "Реєстрацію скасовано", "attendees": attendees}
+
+
+@app.post("/events/{id}/rsvp/bulk")
+async def bulk_rsvp(id: int, bulk: BulkRSVP):
+    registered, attendees = await reserve(id, bulk.emails)
+    return {"registered": registered, "attendees": attendees}
+
+
+@app.post("/events/{id}/rsvp/bulk_cancel")
+async def bulk_cancel_rsvp(id: int, bulk: BulkRSVP):
+    cancelled, attendees = await cancel(id, bulk.emails)
+    return {"cancelled": cancelled, "attendees": attendees}
+
+
+@app.get("/events/{id}/attendees")
+async def list_attendees(id: int, offset: int = Query(0, ge=0), limit: int = Query(100, gt=0, le=1000)):
+    result = await call(app.state.storage.attendees, id, offset, limit)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    attendees, free_places, emails = result
+    return {"attendees": attendees, "free_places": free_places, "emails": emails}
+
+
+@app.get("/metrics/scheduler")
+async def scheduler_metrics():
+    return app.state.scheduler.metrics()
+
+
+@app.get("/metrics/storage")
+async def storage_metrics():
+    return getattr(app.state.storage, "stats", {})
+
+
+@app.get("/metrics/singleflight")
+async def singleflight_metrics():
+    return {"get_one_book": book_flights.metrics(), "get_event": event_flights.metrics()}
+
+
+install_from_env(app)
+
+
+def test_create_event_with_aware_datetime(monkeypatch) -> None:
+    monkeypatch.setitem(globals(), "BOOK_STORAGE", "memory")
+    date = (datetime.now(timezone.utc) + timedelta(minutes=30)).replace(microsecond=0)
+    event = {"id": 100, "title": "Meetup", "description": "Talks", "date": date.isoformat(), "location": "Kyiv"}
+
+    with TestClient(app) as client:
+        created = client.post("/events", json=event, headers={"X-Role": "admin"})
+        moved = client.patch(
+            "/events/100/reschedule",
+            params={"new_date": (date + timedelta(minutes=10)).isoformat()},
+            headers={"X-Role": "admin"},
+        )
+
+    assert created.status_code == 201
+    assert datetime.fromisoformat(created.json()["date"]) == date.astimezone().replace(tzinfo=None)
+    assert moved.status_code == 200
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+from pydantic import BaseModel, Field, EmailStr, field_validator
+import bcrypt
+import re
+from datetime import datetime
+
+
+class AddBook(BaseModel):
+    id: int
+    name: str = Field(..., description="Назва книги")
+    author: str = Field(..., description="Автор книги")
+    year: int
+    number: int
+
+PASSWORD_RULES = (
+    (re.compile(r"[a-z]"), "Password must contain at least one lowercase letter."),
+    (re.compile(r"[A-Z]"), "Password must contain at least one uppercase letter."),
+    (re.compile(r"\d"), "Password must contain at least one digit."),
+    (re.compile(r"[!@#$%^&*()_+=\-]"), "Password must contain at least one special character."),
+)
+
+class RegisterUser(BaseModel):
+    name: str = Field(min_length=2)
+    surname: str = Field(min_length=2)
+    email: EmailStr = Field(description="email")
+    password: str = Field(
+        min_length=8,
+        description="Має містити хоча б одну велику літеру, одну маленьку, одну цифру та один спецсимвол"
+    )
+    phone_number:str = Field(pattern=r"^\+?\d{10,15}$")
+
+    @field_validator("password")
+    @classmethod
+    def validate_password(cls, v):
+        for pattern, message in PASSWORD_RULES:
+            if not pattern.search(v):
+                raise ValueError(message)
+        return v
+
+def local_naive(value: datetime) -> datetime:
+    # storage and the scheduler compare against datetime.now(), so an offset is converted to local time and dropped
+    if value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+
+def with_hashed_password(user: RegisterUser) -> RegisterUser:
+    # model_copy skips validation, which would reject the hash as a password
+    return user.model_copy(update={"password": hash_password(user.password)})
+
+
+class Event(BaseModel):
+    id: int
+    title: str
+    description: str
+    date: datetime
+    location: str
+    capacity: int | None = Field(None, gt=0, description="Максимальна кількість учасників")
+
+    @field_validator("date")
+    @classmethod
+    def validate_date(cls, v):
+        return local_naive(v)
+
+
+class BulkRSVP(BaseModel):
+    emails: list[str] = Field(..., min_length=1)
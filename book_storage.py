@@ -0,0 +1,1029 @@
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import count, islice
+
+from book_models import AddBook, RegisterUser, Event, with_hashed_password
+
+logger = logging.getLogger(__name__)
+
+
+class CapacityError(Exception):
+    def __init__(self, places: int):
+        super().__init__(f"Not enough free places: {places}")
+        self.places = places
+
+
+class SortedIndex:
+    def __init__(self):
+        self.entries = []
+
+    def add(self, key, id):
+        insort(self.entries, (key, id))
+
+    def remove(self, key, id):
+        i = bisect_left(self.entries, (key, id))
+        if i < len(self.entries) and self.entries[i] == (key, id):
+            del self.entries[i]
+
+    def bounds(self, low=None, high=None):
+        start = 0 if low is None else bisect_left(self.entries, (low,))
+        end = len(self.entries) if high is None else bisect_right(self.entries, (high, float("inf")))
+        return start, end
+
+    def count(self, low=None, high=None):
+        start, end = self.bounds(low, high)
+        return max(end - start, 0)
+
+    def range(self, low=None, high=None):
+        start, end = self.bounds(low, high)
+        for i in range(start, end):
+            yield self.entries[i][1]
+
+    def newest(self, offset, limit):
+        end = max(len(self.entries) - offset, 0)
+        return [id for _, id in reversed(self.entries[max(end - limit, 0):end])]
+
+
+class GroupIndex:
+    # every group is kept in order on write, so a query walks it instead of sorting it
+    def __init__(self):
+        self.groups = {}
+
+    def add(self, key, order, id):
+        self.groups.setdefault(key, SortedIndex()).add(order, id)
+
+    def remove(self, key, order, id):
+        group = self.groups.get(key)
+        if group is not None:
+            group.remove(order, id)
+            if not group.entries:
+                del self.groups[key]
+
+    def count(self, key):
+        group = self.groups.get(key)
+        return 0 if group is None else group.count()
+
+    def range(self, key):
+        group = self.groups.get(key)
+        return iter(()) if group is None else group.range()
+
+
+def in_range(value, low, high):
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+def smallest_candidates(candidates, default):
+    # (ids, whether they already come in the result order)
+    if not candidates:
+        return default, False
+    _, ids, ordered = min(candidates, key=lambda c: c[0])
+    return ids(), ordered
+
+
+def first(items, limit, ordered, key):
+    if ordered:
+        return list(islice(items, limit))
+    return heapq.nsmallest(limit, items, key=key)
+
+
+class BookStorage(ABC):
+    # whether callers off the request path should run storage calls on a thread
+    offload = True
+
+    @abstractmethod
+    def seed(self, books, users, events, rsvps):
+        ...
+
+    @abstractmethod
+    def list_books(self):
+        ...
+
+    @abstractmethod
+    def get_book(self, id: int):
+        ...
+
+    @abstractmethod
+    def add_book(self, book: AddBook) -> bool:
+        ...
+
+    @abstractmethod
+    def search_books(self, author, min_year, max_year, min_number, max_number, limit):
+        ...
+
+    @abstractmethod
+    def add_user(self, user: RegisterUser) -> str | None:
+        ...
+
+    @abstractmethod
+    def list_events(self):
+        ...
+
+    @abstractmethod
+    def get_event(self, id: int):
+        ...
+
+    @abstractmethod
+    def create_event(self, event: Event) -> bool:
+        ...
+
+    @abstractmethod
+    def put_event(self, event: Event) -> bool:
+        ...
+
+    @abstractmethod
+    def delete_event(self, id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def reschedule_event(self, id: int, new_date: datetime):
+        ...
+
+    @abstractmethod
+    def search_events(self, start, end, location, limit):
+        ...
+
+    @abstractmethod
+    def add_rsvps(self, id: int, emails: list[str]):
+        ...
+
+    @abstractmethod
+    def cancel_rsvps(self, id: int, emails: list[str]):
+        ...
+
+    @abstractmethod
+    def attendees(self, id: int, offset: int, limit: int):
+        ...
+
+    @abstractmethod
+    def archive_events(self, before: datetime) -> list[int]:
+        ...
+
+    @abstractmethod
+    def list_archived_events(self, offset: int, limit: int):
+        ...
+
+    @abstractmethod
+    def claim_run(self, name: str, interval: float) -> bool:
+        # whether this worker runs the periodic job now; the others skip it
+        ...
+
+    @abstractmethod
+    def claim_reminder(self, id: int, date: datetime) -> bool:
+        # True only for the first caller, so one worker sends the reminders for an event date
+        ...
+
+    def close(self):
+        pass
+
+
+class MemoryStorage(BookStorage):
+    offload = False
+
+    def __init__(self):
+        self.books = {}
+        self.users = {}
+        self.users_by_email = {}
+        self.user_ids = count(1)
+        self.events = {}
+        self.rsvps = {}
+        self.books_by_author = GroupIndex()
+        self.books_by_year = SortedIndex()
+        self.books_by_number = SortedIndex()
+        self.events_by_date = SortedIndex()
+        self.events_by_location = GroupIndex()
+        self.archived_events = {}
+        self.archived_rsvps = {}
+        self.archived_by_date = SortedIndex()
+        self.reminded = {}
+
+    def seed(self, books, users, events, rsvps):
+        for book in books:
+            self.add_book(book)
+        for user in users:
+            self.add_user(with_hashed_password(user))
+        for event in events:
+            self.create_event(event)
+        for id, emails in rsvps.items():
+            self.add_rsvps(id, emails)
+
+    def index_book(self, book: AddBook):
+        self.books_by_author.add(book.author, book.id, book.id)
+        self.books_by_year.add(book.year, book.id)
+        self.books_by_number.add(book.number, book.id)
+
+    def index_event(self, event: Event):
+        self.events_by_date.add(event.date, event.id)
+        self.events_by_location.add(event.location, event.date, event.id)
+
+    def unindex_event(self, event: Event):
+        self.events_by_date.remove(event.date, event.id)
+        self.events_by_location.remove(event.location, event.date, event.id)
+
+    def list_books(self):
+        return list(self.books.values())
+
+    def get_book(self, id: int):
+        return self.books.get(id)
+
+    def add_book(self, book: AddBook) -> bool:
+        if book.id in self.books:
+            return False
+        self.books[book.id] = book
+        self.index_book(book)
+        return True
+
+    def search_books(self, author, min_year, max_year, min_number, max_number, limit):
+        # same order as SQLiteStorage: year, id with a year range, id otherwise
+        by_year = min_year is not None or max_year is not None
+        candidates = []
+        if author is not None:
+            candidates.append((
+                self.books_by_author.count(author), lambda: self.books_by_author.range(author), not by_year
+            ))
+        if by_year:
+            candidates.append((
+                self.books_by_year.count(min_year, max_year),
+                lambda: self.books_by_year.range(min_year, max_year),
+                True,
+            ))
+        if min_number is not None or max_number is not None:
+            candidates.append((
+                self.books_by_number.count(min_number, max_number),
+                lambda: self.books_by_number.range(min_number, max_number),
+                False,
+            ))
+
+        ids, ordered = smallest_candidates(candidates, self.books)
+        books = (
+            book for book in map(self.books.__getitem__, ids)
+            if (author is None or book.author == author)
+            and in_range(book.year, min_year, max_year)
+            and in_range(book.number, min_number, max_number)
+        )
+        return first(books, limit, ordered, (lambda book: (book.year, book.id)) if by_year else (lambda book: book.id))
+
+    def add_user(self, user: RegisterUser) -> str | None:
+        email = user.email.lower()
+        if email in self.users_by_email:
+            return None
+        key = f"user{next(self.user_ids)}"
+        self.users[key] = user
+        self.users_by_email[email] = key
+        return key
+
+    def list_events(self):
+        return list(self.events.values())
+
+    def get_event(self, id: int):
+        return self.events.get(id)
+
+    def create_event(self, event: Event) -> bool:
+        if event.id in self.events:
+            return False
+        self.events[event.id] = event
+        self.index_event(event)
+        return True
+
+    def put_event(self, event: Event) -> bool:
+        if event.id not in self.events:
+            return False
+        attendees = len(self.rsvps.get(event.id, ()))
+        if event.capacity is not None and attendees > event.capacity:
+            raise CapacityError(event.capacity - attendees)
+        self.unindex_event(self.events[event.id])
+        self.events[event.id] = event
+        self.index_event(event)
+        return True
+
+    def delete_event(self, id: int) -> bool:
+        if id not in self.events:
+            return False
+        self.unindex_event(self.events.pop(id))
+        self.rsvps.pop(id, None)
+        self.reminded.pop(id, None)
+        return True
+
+    def reschedule_event(self, id: int, new_date: datetime):
+        event = self.events.get(id)
+        if event is None:
+            return None
+        self.unindex_event(event)
+        event.date = new_date
+        self.index_event(event)
+        return event
+
+    def search_events(self, start, end, location, limit):
+        # same order as SQLiteStorage: date, id with any filter, id otherwise
+        candidates = []
+        if start is not None or end is not None:
+            candidates.append((
+                self.events_by_date.count(start, end), lambda: self.events_by_date.range(start, end), True
+            ))
+        if location is not None:
+            candidates.append((
+                self.events_by_location.count(location), lambda: self.events_by_location.range(location), True
+            ))
+
+        ids, ordered = smallest_candidates(candidates, self.events)
+        events = (
+            event for event in map(self.events.__getitem__, ids)
+            if in_range(event.date, start, end) and (location is None or event.location == location)
+        )
+        return first(events, limit, ordered, (lambda event: (event.date, event.id)) if candidates else (lambda event: event.id))
+
+    def free_places(self, id: int, attendees: dict):
+        capacity = self.events[id].capacity
+        if capacity is None:
+            return None
+        return capacity - len(attendees)
+
+    def add_rsvps(self, id: int, emails: list[str]):
+        if id not in self.events:
+            return None
+        attendees = self.rsvps.setdefault(id, {})
+        new_emails = [email for email in dict.fromkeys(emails) if email not in attendees]
+        places = self.free_places(id, attendees)
+        if places is not None and len(new_emails) > places:
+            raise CapacityError(places)
+        attendees.update(dict.fromkeys(new_emails))
+        return new_emails, len(attendees)
+
+    def cancel_rsvps(self, id: int, emails: list[str]):
+        if id not in self.events:
+            return None
+        attendees = self.rsvps.setdefault(id, {})
+        cancelled = []
+        for email in dict.fromkeys(emails):
+            if email in attendees:
+                del attendees[email]
+                cancelled.append(email)
+        return cancelled, len(attendees)
+
+    def attendees(self, id: int, offset: int, limit: int):
+        if id not in self.events:
+            return None
+        attendees = self.rsvps.setdefault(id, {})
+        return len(attendees), self.free_places(id, attendees), list(islice(attendees, offset, offset + limit))
+
+    def archive_events(self, before: datetime) -> list[int]:
+        ids = list(self.events_by_date.range(None, before))
+        for id in ids:
+            event = self.events.pop(id)
+            self.unindex_event(event)
+            old = self.archived_events.get(id)
+            if old is not None:
+                self.archived_by_date.remove(old.date, id)
+            self.archived_events[id] = event
+            self.archived_by_date.add(event.date, id)
+            self.archived_rsvps[id] = self.rsvps.pop(id, {})
+            self.reminded.pop(id, None)
+        return ids
+
+    def list_archived_events(self, offset: int, limit: int):
+        return [self.archived_events[id] for id in self.archived_by_date.newest(offset, limit)]
+
+    def claim_run(self, name: str, interval: float) -> bool:
+        return True
+
+    def claim_reminder(self, id: int, date: datetime) -> bool:
+        if self.reminded.get(id) == date:
+            return False
+        self.reminded[id] = date
+        return True
+
+
+BOOK_COLUMNS = "id, name, author, year, number"
+EVENT_COLUMNS = "id, title, description, date, location, capacity"
+
+
+def book_from_row(row):
+    return AddBook.model_construct(
+        id=row["id"], name=row["name"], author=row["author"], year=row["year"], number=row["number"]
+    )
+
+
+def event_from_row(row):
+    return Event.model_construct(
+        id=row["id"],
+        title=row["title"],
+        description=row["description"],
+        date=datetime.fromisoformat(row["date"]),
+        location=row["location"],
+        capacity=row["capacity"],
+    )
+
+
+def event_params(event: Event):
+    return (event.id, event.title, event.description, event.date.isoformat(), event.location, event.capacity)
+
+
+def range_clause(column, low, high, where, params):
+    if low is not None:
+        where.append(f"{column} >= ?")
+        params.append(low)
+    if high is not None:
+        where.append(f"{column} <= ?")
+        params.append(high)
+
+
+def existing_ids(cursor, table, ids):
+    if not ids:
+        return set()
+    marks = ", ".join("?" * len(ids))
+    return {row[0] for row in cursor.execute(f"SELECT id FROM {table} WHERE id IN ({marks})", ids)}
+
+
+class SQLiteStorage(BookStorage):
+    def __init__(self, path: str = "book.db"):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA busy_timeout = 5000")
+        self.init_db()
+
+    def init_db(self):
+        with self.lock:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS Books (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    author TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    number INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_books_author ON Books(author);
+                CREATE INDEX IF NOT EXISTS idx_books_year ON Books(year);
+                CREATE INDEX IF NOT EXISTS idx_books_number ON Books(number);
+
+                CREATE TABLE IF NOT EXISTS Users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    surname TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    password TEXT NOT NULL,
+                    phone_number TEXT NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS Events (
+                    id INTEGER PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    capacity INTEGER,
+                    attendees INTEGER NOT NULL DEFAULT 0,
+                    reminded_for TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_events_date ON Events(date);
+                CREATE INDEX IF NOT EXISTS idx_events_location ON Events(location, date);
+
+                CREATE TABLE IF NOT EXISTS Rsvps (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_id INTEGER NOT NULL,
+                    email TEXT NOT NULL,
+                    UNIQUE(event_id, email),
+                    FOREIGN KEY(event_id) REFERENCES Events(id) ON DELETE CASCADE
+                );
+                CREATE INDEX IF NOT EXISTS idx_rsvps_event_seq ON Rsvps(event_id, seq);
+
+                CREATE TABLE IF NOT EXISTS ArchivedEvents (
+                    id INTEGER PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    capacity INTEGER,
+                    attendees INTEGER NOT NULL DEFAULT 0,
+                    archived_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_archived_events_date ON ArchivedEvents(date);
+
+                CREATE TABLE IF NOT EXISTS ArchivedRsvps (
+                    seq INTEGER PRIMARY KEY,
+                    event_id INTEGER NOT NULL,
+                    email TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_archived_rsvps_event ON ArchivedRsvps(event_id, seq);
+
+                CREATE TABLE IF NOT EXISTS SchedulerRuns (
+                    name TEXT PRIMARY KEY,
+                    last_run REAL NOT NULL
+                );
+            ''')
+            columns = {row["name"] for row in self.connection.execute("PRAGMA table_info(Events)")}
+            if "reminded_for" not in columns:
+                self.connection.execute("ALTER TABLE Events ADD COLUMN reminded_for TEXT")
+        self.migrate_unique_email()
+
+    def migrate_unique_email(self):
+        # book.db files from before the unique index can hold the same email twice, which would make
+        # CREATE UNIQUE INDEX fail; which of those users to keep is for a person to decide
+        with self.transaction() as cursor:
+            exists = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_users_unique_email'"
+            ).fetchone()
+            if exists:
+                return
+            duplicates = [row[0] for row in cursor.execute(
+                "SELECT MIN(email) FROM Users GROUP BY email COLLATE NOCASE HAVING COUNT(*) > 1 ORDER BY 1"
+            )]
+            if duplicates:
+                raise RuntimeError(
+                    f"emails registered more than once in Users: {', '.join(duplicates)}. "
+                    "Merge or delete the extra rows, then start again to add the unique email index."
+                )
+            # the unique index covers the same lookups
+            cursor.execute("DROP INDEX IF EXISTS idx_users_email")
+            cursor.execute("CREATE UNIQUE INDEX idx_users_unique_email ON Users(email COLLATE NOCASE)")
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            else:
+                cursor.execute("COMMIT")
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def seed(self, books, users, events, rsvps):
+        with self.transaction() as cursor:
+            if cursor.execute("SELECT 1 FROM Books LIMIT 1").fetchone():
+                return
+            users = [with_hashed_password(u) for u in users]
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO Books ({BOOK_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                [(b.id, b.name, b.author, b.year, b.number) for b in books],
+            )
+            cursor.executemany(
+                "INSERT OR IGNORE INTO Users (name, surname, email, password, phone_number) VALUES (?, ?, ?, ?, ?)",
+                [(u.name, u.surname, u.email, u.password, u.phone_number) for u in users],
+            )
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO Events ({EVENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                [event_params(e) for e in events],
+            )
+            for id, emails in rsvps.items():
+                self.insert_rsvps(cursor, id, emails)
+
+    def list_books(self):
+        return [book_from_row(row) for row in self.query(f"SELECT {BOOK_COLUMNS} FROM Books ORDER BY id")]
+
+    def get_book(self, id: int):
+        rows = self.query(f"SELECT {BOOK_COLUMNS} FROM Books WHERE id = ?", (id,))
+        return book_from_row(rows[0]) if rows else None
+
+    def add_book(self, book: AddBook) -> bool:
+        with self.transaction() as cursor:
+            cursor.execute(
+                f"INSERT OR IGNORE INTO Books ({BOOK_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                (book.id, book.name, book.author, book.year, book.number),
+            )
+            return cursor.rowcount == 1
+
+    def search_books(self, author, min_year, max_year, min_number, max_number, limit):
+        where, params = [], []
+        if author is not None:
+            where.append("author = ?")
+            params.append(author)
+        range_clause("year", min_year, max_year, where, params)
+        range_clause("number", min_number, max_number, where, params)
+        order = "year, id" if min_year is not None or max_year is not None else "id"
+        sql = f"SELECT {BOOK_COLUMNS} FROM Books"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order} LIMIT ?"
+        return [book_from_row(row) for row in self.query(sql, (*params, limit))]
+
+    def add_user(self, user: RegisterUser) -> str | None:
+        with self.transaction() as cursor:
+            cursor.execute(
+                "INSERT OR IGNORE INTO Users (name, surname, email, password, phone_number) VALUES (?, ?, ?, ?, ?)",
+                (user.name, user.surname, user.email, user.password, user.phone_number),
+            )
+            if cursor.rowcount == 0:
+                return None
+            return f"user{cursor.lastrowid}"
+
+    def list_events(self):
+        return [event_from_row(row) for row in self.query(f"SELECT {EVENT_COLUMNS} FROM Events ORDER BY id")]
+
+    def get_event(self, id: int):
+        rows = self.query(f"SELECT {EVENT_COLUMNS} FROM Events WHERE id = ?", (id,))
+        return event_from_row(rows[0]) if rows else None
+
+    def create_event(self, event: Event) -> bool:
+        with self.transaction() as cursor:
+            cursor.execute(
+                f"INSERT OR IGNORE INTO Events ({EVENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                event_params(event),
+            )
+            return cursor.rowcount == 1
+
+    def put_event(self, event: Event) -> bool:
+        with self.transaction() as cursor:
+            row = cursor.execute("SELECT attendees FROM Events WHERE id = ?", (event.id,)).fetchone()
+            if row is None:
+                return False
+            if event.capacity is not None and row["attendees"] > event.capacity:
+                raise CapacityError(event.capacity - row["attendees"])
+            cursor.execute(
+                "UPDATE Events SET title = ?, description = ?, date = ?, location = ?, capacity = ? WHERE id = ?",
+                (*event_params(event)[1:], event.id),
+            )
+            return True
+
+    def delete_event(self, id: int) -> bool:
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM Events WHERE id = ?", (id,))
+            return cursor.rowcount == 1
+
+    def reschedule_event(self, id: int, new_date: datetime):
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE Events SET date = ? WHERE id = ?", (new_date.isoformat(), id))
+            if cursor.rowcount == 0:
+                return None
+            row = cursor.execute(f"SELECT {EVENT_COLUMNS} FROM Events WHERE id = ?", (id,)).fetchone()
+            return event_from_row(row)
+
+    def search_events(self, start, end, location, limit):
+        where, params = [], []
+        if location is not None:
+            where.append("location = ?")
+            params.append(location)
+        range_clause(
+            "date",
+            start.isoformat() if start is not None else None,
+            end.isoformat() if end is not None else None,
+            where,
+            params,
+        )
+        sql = f"SELECT {EVENT_COLUMNS} FROM Events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY date, id LIMIT ?" if start is not None or end is not None or location is not None else " ORDER BY id LIMIT ?"
+        return [event_from_row(row) for row in self.query(sql, (*params, limit))]
+
+    def insert_rsvps(self, cursor, id, emails):
+        row = cursor.execute("SELECT capacity, attendees FROM Events WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            return None
+        new_emails = [
+            email for email in dict.fromkeys(emails)
+            if cursor.execute("SELECT 1 FROM Rsvps WHERE event_id = ? AND email = ?", (id, email)).fetchone() is None
+        ]
+        if row["capacity"] is not None and len(new_emails) > row["capacity"] - row["attendees"]:
+            raise CapacityError(row["capacity"] - row["attendees"])
+        cursor.executemany("INSERT INTO Rsvps (event_id, email) VALUES (?, ?)", [(id, email) for email in new_emails])
+        cursor.execute("UPDATE Events SET attendees = attendees + ? WHERE id = ?", (len(new_emails), id))
+        return new_emails, row["attendees"] + len(new_emails)
+
+    def add_rsvps(self, id: int, emails: list[str]):
+        with self.transaction() as cursor:
+            return self.insert_rsvps(cursor, id, emails)
+
+    def cancel_rsvps(self, id: int, emails: list[str]):
+        with self.transaction() as cursor:
+            row = cursor.execute("SELECT attendees FROM Events WHERE id = ?", (id,)).fetchone()
+            if row is None:
+                return None
+            cancelled = []
+            for email in dict.fromkeys(emails):
+                cursor.execute("DELETE FROM Rsvps WHERE event_id = ? AND email = ?", (id, email))
+                if cursor.rowcount:
+                    cancelled.append(email)
+            cursor.execute("UPDATE Events SET attendees = attendees - ? WHERE id = ?", (len(cancelled), id))
+            return cancelled, row["attendees"] - len(cancelled)
+
+    def attendees(self, id: int, offset: int, limit: int):
+        with self.lock:
+            row = self.connection.execute("SELECT capacity, attendees FROM Events WHERE id = ?", (id,)).fetchone()
+            if row is None:
+                return None
+            emails = self.connection.execute(
+                "SELECT email FROM Rsvps WHERE event_id = ? ORDER BY seq LIMIT ? OFFSET ?", (id, limit, offset)
+            ).fetchall()
+        free_places = None if row["capacity"] is None else row["capacity"] - row["attendees"]
+        return row["attendees"], free_places, [email["email"] for email in emails]
+
+    def archive_events(self, before: datetime) -> list[int]:
+        with self.transaction() as cursor:
+            ids = [row["id"] for row in cursor.execute(
+                "SELECT id FROM Events WHERE date <= ? ORDER BY date, id", (before.isoformat(),)
+            )]
+            if not ids:
+                return ids
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS archiving (id INTEGER PRIMARY KEY)")
+            cursor.execute("DELETE FROM archiving")
+            cursor.executemany("INSERT INTO archiving (id) VALUES (?)", [(id,) for id in ids])
+            # an id archived before and created again replaces its old copy
+            cursor.execute("DELETE FROM ArchivedRsvps WHERE event_id IN (SELECT id FROM archiving)")
+            cursor.execute(
+                f'''INSERT OR REPLACE INTO ArchivedEvents ({EVENT_COLUMNS}, attendees, archived_at)
+                    SELECT {EVENT_COLUMNS}, attendees, ? FROM Events WHERE id IN (SELECT id FROM archiving)''',
+                (datetime.now().isoformat(),),
+            )
+            cursor.execute(
+                "INSERT INTO ArchivedRsvps (event_id, email) "
+                "SELECT event_id, email FROM Rsvps WHERE event_id IN (SELECT id FROM archiving) ORDER BY seq"
+            )
+            # the Rsvps rows go with their events through ON DELETE CASCADE
+            cursor.execute("DELETE FROM Events WHERE id IN (SELECT id FROM archiving)")
+            return ids
+
+    def data_version(self) -> int:
+        # changes whenever another connection, e.g. another worker, commits to the database
+        return self.query("PRAGMA data_version")[0][0]
+
+    def list_archived_events(self, offset: int, limit: int):
+        rows = self.query(
+            f"SELECT {EVENT_COLUMNS} FROM ArchivedEvents ORDER BY date DESC, id DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        return [event_from_row(row) for row in rows]
+
+    def claim_run(self, name: str, interval: float) -> bool:
+        # every worker ticks on its own timer; half the interval leaves room for a late tick of the same worker
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute("INSERT OR IGNORE INTO SchedulerRuns (name, last_run) VALUES (?, 0)", (name,))
+            cursor.execute(
+                "UPDATE SchedulerRuns SET last_run = ? WHERE name = ? AND last_run <= ?", (now, name, now - interval / 2)
+            )
+            return cursor.rowcount == 1
+
+    def claim_reminder(self, id: int, date: datetime) -> bool:
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE Events SET reminded_for = ? WHERE id = ? AND date = ? AND reminded_for IS NOT ?",
+                (date.isoformat(), id, date.isoformat(), date.isoformat()),
+            )
+            return cursor.rowcount == 1
+
+    def write_batch(self, books, events) -> tuple[set[int], set[int]]:
+        # returns the ids that already existed, e.g. written by another worker since they were queued
+        with self.transaction() as cursor:
+            book_conflicts = existing_ids(cursor, "Books", [b.id for b in books])
+            cursor.executemany(
+                f"INSERT INTO Books ({BOOK_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                [(b.id, b.name, b.author, b.year, b.number) for b in books if b.id not in book_conflicts],
+            )
+            event_conflicts = existing_ids(cursor, "Events", [e.id for e in events])
+            cursor.executemany(
+                f"INSERT INTO Events ({EVENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                [event_params(e) for e in events if e.id not in event_conflicts],
+            )
+        return book_conflicts, event_conflicts
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class WriteBehindCache(BookStorage):
+    def __init__(self, storage: SQLiteStorage, flush_interval: float = 0.05, max_entries: int = 10_000):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.books = {}
+        self.events = {}
+        # id -> (value, Future); a new book or event is only reported as added once its batch is committed
+        self.pending_books = {}
+        self.pending_events = {}
+        self.stats = {"batches": 0, "written": 0, "conflicts": 0, "errors": 0}
+        # bumped on every invalidation, so a read that raced with a write does not cache the old row
+        self.generation = 0
+        self.data_version = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.queued = threading.Event()
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flusher.start()
+
+    def flush_loop(self):
+        # writes go out as soon as they are queued; whatever arrives during a write joins the next batch
+        while not self.stopped.is_set():
+            self.queued.wait(self.flush_interval)
+            self.queued.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("write-behind flush to SQLite failed")
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                books, self.pending_books = self.pending_books, {}
+                events, self.pending_events = self.pending_events, {}
+            if not (books or events):
+                return
+            # the lock is not held while SQLite writes, so reads and new writes go on meanwhile
+            try:
+                book_conflicts, event_conflicts = self.storage.write_batch(
+                    [book for book, _ in books.values()], [event for event, _ in events.values()]
+                )
+            except Exception as e:
+                self.stats["errors"] += 1
+                for _, future in (*books.values(), *events.values()):
+                    future.set_exception(e)
+                raise
+            self.stats["batches"] += 1
+            self.stats["written"] += len(books) + len(events) - len(book_conflicts) - len(event_conflicts)
+            self.stats["conflicts"] += len(book_conflicts) + len(event_conflicts)
+            if book_conflicts or event_conflicts:
+                logger.warning(
+                    "write-behind skipped existing books %s and events %s", sorted(book_conflicts), sorted(event_conflicts)
+                )
+            with self.lock:
+                for cache, entries, conflicts in ((self.books, books, book_conflicts), (self.events, events, event_conflicts)):
+                    for id, (value, _) in entries.items():
+                        if id not in conflicts:
+                            self.remember(cache, id, value)
+            for entries, conflicts in ((books, book_conflicts), (events, event_conflicts)):
+                for id, (_, future) in entries.items():
+                    future.set_result(id not in conflicts)
+
+    def queue(self, pending, cache, id, value) -> bool:
+        with self.lock:
+            if id in cache or id in pending:
+                return False
+            future = Future()
+            pending[id] = (value, future)
+        self.queued.set()
+        return future.result()
+
+    def remember(self, cache, id, value):
+        cache.pop(id, None)
+        cache[id] = value
+        if len(cache) > self.max_entries:
+            del cache[next(iter(cache))]
+
+    def cached(self, cache, id, load):
+        # writes from other workers never reach this cache, so any commit of theirs drops all of it
+        version = self.storage.data_version()
+        with self.lock:
+            if version != self.data_version:
+                self.data_version = version
+                self.books.clear()
+                self.events.clear()
+                self.generation += 1
+            value = cache.get(id)
+            generation = self.generation
+        if value is not None:
+            return value
+        value = load(id)
+        if value is not None:
+            with self.lock:
+                if generation == self.generation:
+                    self.remember(cache, id, value)
+        return value
+
+    def forget(self, cache, id):
+        with self.lock:
+            cache.pop(id, None)
+            self.generation += 1
+
+    def seed(self, books, users, events, rsvps):
+        self.storage.seed(books, users, events, rsvps)
+
+    def list_books(self):
+        self.flush()
+        return self.storage.list_books()
+
+    def get_book(self, id: int):
+        return self.cached(self.books, id, self.storage.get_book)
+
+    def add_book(self, book: AddBook) -> bool:
+        return self.queue(self.pending_books, self.books, book.id, book)
+
+    def search_books(self, *args):
+        self.flush()
+        return self.storage.search_books(*args)
+
+    def add_user(self, user: RegisterUser) -> str | None:
+        return self.storage.add_user(user)
+
+    def list_events(self):
+        self.flush()
+        return self.storage.list_events()
+
+    def get_event(self, id: int):
+        return self.cached(self.events, id, self.storage.get_event)
+
+    def create_event(self, event: Event) -> bool:
+        return self.queue(self.pending_events, self.events, event.id, event)
+
+    def put_event(self, event: Event) -> bool:
+        self.flush()
+        try:
+            return self.storage.put_event(event)
+        finally:
+            self.forget(self.events, event.id)
+
+    def delete_event(self, id: int) -> bool:
+        self.flush()
+        try:
+            return self.storage.delete_event(id)
+        finally:
+            self.forget(self.events, id)
+
+    def reschedule_event(self, id: int, new_date: datetime):
+        self.flush()
+        try:
+            return self.storage.reschedule_event(id, new_date)
+        finally:
+            self.forget(self.events, id)
+
+    def search_events(self, *args):
+        self.flush()
+        return self.storage.search_events(*args)
+
+    def add_rsvps(self, id: int, emails: list[str]):
+        self.flush()
+        return self.storage.add_rsvps(id, emails)
+
+    def cancel_rsvps(self, id: int, emails: list[str]):
+        self.flush()
+        return self.storage.cancel_rsvps(id, emails)
+
+    def attendees(self, id: int, offset: int, limit: int):
+        self.flush()
+        return self.storage.attendees(id, offset, limit)
+
+    def archive_events(self, before: datetime) -> list[int]:
+        self.flush()
+        ids = self.storage.archive_events(before)
+        for id in ids:
+            self.forget(self.events, id)
+        return ids
+
+    def list_archived_events(self, offset: int, limit: int):
+        return self.storage.list_archived_events(offset, limit)
+
+    def claim_run(self, name: str, interval: float) -> bool:
+        return self.storage.claim_run(name, interval)
+
+    def claim_reminder(self, id: int, date: datetime) -> bool:
+        self.flush()
+        return self.storage.claim_reminder(id, date)
+
+    def close(self):
+        self.stopped.set()
+        self.queued.set()
+        self.flusher.join()
+        self.flush()
+        self.storage.close()
+
+
+def test_search_order_matches_between_backends(tmp_path) -> None:
+    books = [
+        AddBook(id=i, name=f"Book {i}", author="A" if i % 2 else "B", year=1990 + (20 - i) % 7, number=i * 37 % 100)
+        for i in range(1, 41)
+    ]
+    base = datetime(2030, 1, 1, 10, 0)
+    events = [
+        Event(id=i, title=f"Event {i}", description="", date=base + timedelta(days=(40 - i) % 13), location=f"L{i % 3}")
+        for i in range(1, 31)
+    ]
+    memory = MemoryStorage()
+    sqlite = SQLiteStorage(str(tmp_path / "book.db"))
+    for storage in (memory, sqlite):
+        storage.seed(books, [], events, {})
+
+    try:
+        for query in (
+            ("A", None, None, 0, 90, 3),
+            ("A", 1992, None, None, None, 5),
+            (None, None, None, 10, 50, 4),
+            (None, None, None, None, None, 6),
+            ("B", None, 1994, 0, 99, 10),
+        ):
+            assert [b.id for b in memory.search_books(*query)] == [b.id for b in sqlite.search_books(*query)], query
+        for query in (
+            (None, None, "L1", 5),
+            (base + timedelta(days=3), None, None, 4),
+            (None, base + timedelta(days=8), "L2", 3),
+            (None, None, None, 7),
+        ):
+            assert [e.id for e in memory.search_events(*query)] == [e.id for e in sqlite.search_events(*query)], query
+    finally:
+        sqlite.close()
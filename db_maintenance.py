@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import secrets
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+from fastapi import Header, HTTPException, Request
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = Path(os.getenv("DB_BACKUP_DIR", "backups"))
+MAINTENANCE_INTERVAL = float(os.getenv("DB_MAINTENANCE_INTERVAL", "3600"))
+BACKUP_KEEP = int(os.getenv("DB_BACKUP_KEEP", "5"))
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+class DatabaseMaintenance:
+    def __init__(
+        self,
+        path: str,
+        backup_dir: Path = BACKUP_DIR,
+        interval: float = MAINTENANCE_INTERVAL,
+        keep: int = BACKUP_KEEP,
+        pages: int = 256,
+        step_sleep: float = 0.005,
+        vacuum_pages: int = 256,
+        max_restarts: int = 3,
+    ):
+        self.path = path
+        self.name = Path(path).stem
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        # pages copied or freed per step; the database is free for other connections between steps
+        self.pages = pages
+        self.step_sleep = step_sleep
+        self.vacuum_pages = vacuum_pages
+        self.max_restarts = max_restarts
+        self.last = {}
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.closing = False
+        self.wakeup = asyncio.Event()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        connection.execute("PRAGMA busy_timeout = 5000")
+        return connection
+
+    def backups(self) -> list[Path]:
+        return sorted(self.backup_dir.glob(f"{self.name}-*.db"))
+
+    def backup(self) -> dict:
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        target = self.backup_dir / f"{self.name}-{datetime.now():%Y%m%d-%H%M%S-%f}.db"
+        partial = target.with_suffix(".part")
+        start = time.perf_counter()
+        source = self.connect()
+        try:
+            steps = self.copy(source, partial)
+        finally:
+            source.close()
+        partial.replace(target)
+        for old in self.backups()[:-self.keep]:
+            # another worker may be pruning the same directory
+            old.unlink(missing_ok=True)
+        return {
+            "path": str(target),
+            "bytes": target.stat().st_size,
+            "steps": steps,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+    def copy(self, source, partial: Path) -> int:
+        steps = 0
+        remaining = None
+        restarts = 0
+
+        def progress(status, left, total):
+            nonlocal steps, remaining, restarts
+            steps += 1
+            # a write from another connection starts the copy over, so `left` stops going down;
+            # on a database that busy, give up stepping
+            if remaining is not None and left >= remaining:
+                restarts += 1
+                if restarts > self.max_restarts:
+                    raise BackupRestarted()
+            remaining = left
+            time.sleep(self.step_sleep)
+
+        target = sqlite3.connect(partial)
+        try:
+            try:
+                source.backup(target, pages=self.pages, progress=progress)
+            except BackupRestarted:
+                # one step reads a single snapshot; under WAL that does not block writers either
+                source.backup(target, pages=-1)
+                steps += 1
+        finally:
+            target.close()
+        return steps
+
+    def convert(self) -> dict:
+        # switching an existing file to incremental auto_vacuum takes one full VACUUM, which rewrites
+        # the whole database and blocks writers meanwhile, so it only runs when an admin asks for it
+        start = time.perf_counter()
+        connection = self.connect()
+        try:
+            converted = connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+            if converted:
+                connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                connection.execute("VACUUM")
+            return {
+                "converted_to_incremental": converted,
+                "pages": connection.execute("PRAGMA page_count").fetchone()[0],
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+        finally:
+            connection.close()
+
+    def compact(self) -> dict:
+        start = time.perf_counter()
+        connection = self.connect()
+        try:
+            pages_before = connection.execute("PRAGMA page_count").fetchone()[0]
+            free_before = connection.execute("PRAGMA freelist_count").fetchone()[0]
+            incremental = connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+            # without incremental mode there is nothing to free stepwise; see convert()
+            while incremental and connection.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+                connection.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+                time.sleep(self.step_sleep)
+            connection.execute("PRAGMA analysis_limit = 1000")
+            connection.execute("ANALYZE")
+            connection.execute("PRAGMA optimize")
+            checkpoint = connection.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            return {
+                "pages_before": pages_before,
+                "free_pages_before": free_before,
+                "pages_after": connection.execute("PRAGMA page_count").fetchone()[0],
+                "incremental": incremental,
+                "wal_pages_checkpointed": checkpoint[2],
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+        finally:
+            connection.close()
+
+    def export_snapshot(self) -> Path:
+        # VACUUM INTO writes a consistent, defragmented copy from one read transaction
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        target = self.backup_dir / f"export-{self.name}-{secrets.token_hex(8)}.db"
+        connection = self.connect()
+        try:
+            connection.execute("VACUUM INTO ?", (str(target),))
+        finally:
+            connection.close()
+        return target
+
+    async def run_job(self, name: str, function):
+        async with self.lock:
+            result = await asyncio.to_thread(function)
+        self.last[name] = {**result, "finished_at": datetime.now().isoformat(timespec="seconds")}
+        return result
+
+    def claim(self) -> bool:
+        # with several workers only the one that updates the row runs the scheduled jobs; half the
+        # interval leaves room for the same worker waking up a little early next time
+        now = time.time()
+        connection = self.connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS Maintenance (name TEXT PRIMARY KEY, last_run REAL NOT NULL)"
+                )
+                connection.execute("INSERT OR IGNORE INTO Maintenance (name, last_run) VALUES ('scheduled', 0)")
+                cursor = connection.execute(
+                    "UPDATE Maintenance SET last_run = ? WHERE name = 'scheduled' AND last_run <= ?",
+                    (now, now - self.interval / 2),
+                )
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return cursor.rowcount == 1
+        finally:
+            connection.close()
+
+    async def start(self):
+        if self.interval > 0:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while not self.closing:
+            try:
+                claimed = await asyncio.to_thread(self.claim)
+            except Exception:
+                logger.exception("claiming maintenance of %s failed", self.path)
+                claimed = False
+            if claimed:
+                try:
+                    await self.run_job("compact", self.compact)
+                    await self.run_job("backup", self.backup)
+                except Exception:
+                    logger.exception("maintenance of %s failed", self.path)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def status(self) -> dict:
+        return {
+            "database": self.path,
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else None,
+            "interval": self.interval,
+            "backups": [str(path) for path in self.backups()],
+            "last": self.last,
+        }
+
+    async def close(self):
+        # stop through a flag: cancelling the loop inside wait_for can be swallowed
+        self.closing = True
+        self.wakeup.set()
+        if self.task is not None:
+            await self.task
+
+
+def require_admin(x_admin_token: str | None):
+    token = os.getenv("DB_ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=403, detail="DB_ADMIN_TOKEN is not configured")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, token):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+
+
+def install(app, prefix: str = "/admin/db"):
+    async def status(request: Request, x_admin_token: str | None = Header(None, alias="X-Admin-Token")):
+        require_admin(x_admin_token)
+        return request.app.state.maintenance.status()
+
+    async def backup(request: Request, x_admin_token: str | None = Header(None, alias="X-Admin-Token")):
+        require_admin(x_admin_token)
+        maintenance = request.app.state.maintenance
+        return await maintenance.run_job("backup", maintenance.backup)
+
+    async def compact(request: Request, x_admin_token: str | None = Header(None, alias="X-Admin-Token")):
+        require_admin(x_admin_token)
+        maintenance = request.app.state.maintenance
+        return await maintenance.run_job("compact", maintenance.compact)
+
+    async def convert(request: Request, x_admin_token: str | None = Header(None, alias="X-Admin-Token")):
+        require_admin(x_admin_token)
+        maintenance = request.app.state.maintenance
+        return await maintenance.run_job("convert", maintenance.convert)
+
+    async def snapshot(request: Request, x_admin_token: str | None = Header(None, alias="X-Admin-Token")):
+        require_admin(x_admin_token)
+        maintenance = request.app.state.maintenance
+        path = await asyncio.to_thread(maintenance.export_snapshot)
+        return FileResponse(
+            path,
+            media_type="application/vnd.sqlite3",
+            filename=f"{maintenance.name}-{datetime.now():%Y%m%d-%H%M%S}.db",
+            background=BackgroundTask(path.unlink),
+        )
+
+    app.add_api_route(prefix, status, methods=["GET"], include_in_schema=False)
+    app.add_api_route(f"{prefix}/backup", backup, methods=["POST"], include_in_schema=False)
+    app.add_api_route(f"{prefix}/compact", compact, methods=["POST"], include_in_schema=False)
+    app.add_api_route(f"{prefix}/convert", convert, methods=["POST"], include_in_schema=False)
+    app.add_api_route(f"{prefix}/snapshot", snapshot, methods=["GET"], include_in_schema=False)
@@ -0,0 +1,129 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+ATTENDEES_PAGE = 1000
+REFILL_LIMIT = 10_000
+
+
+class EventScheduler:
+    def __init__(
+        self,
+        storage,
+        archive_interval: float = 60.0,
+        remind_before: timedelta = timedelta(hours=1),
+    ):
+        self.storage = storage
+        self.archive_interval = archive_interval
+        self.remind_before = remind_before
+        # (remind_at, event_id, date); only events starting within the next tick are kept here
+        self.reminders = []
+        self.scheduled = set()
+        self.reminded = set()
+        self.outbox = asyncio.Queue()
+        self.stats = {"archived": 0, "reminders_queued": 0, "reminders_sent": 0, "ticks": 0, "sweeps_skipped": 0}
+        self.tasks = []
+        self.closing = False
+        self.wakeup = asyncio.Event()
+
+    async def call(self, function, *args):
+        if self.storage.offload:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self.run()), asyncio.create_task(self.send_reminders())]
+
+    def schedule(self, event):
+        # events created or moved between ticks would otherwise wait for the next refill
+        until_start = event.date - datetime.now()
+        if until_start <= timedelta(0) or until_start > self.remind_before + timedelta(seconds=self.archive_interval):
+            return
+        key = (event.id, event.date)
+        if key in self.scheduled or key in self.reminded:
+            return
+        self.scheduled.add(key)
+        heapq.heappush(self.reminders, (event.date - self.remind_before, event.id, event.date))
+        self.wakeup.set()
+
+    async def tick(self):
+        now = datetime.now()
+        # every worker runs a scheduler; the sweep is claimed in storage so only one of them archives
+        if await self.call(self.storage.claim_run, "archive", self.archive_interval):
+            archived = await self.call(self.storage.archive_events, now)
+            self.stats["archived"] += len(archived)
+        else:
+            self.stats["sweeps_skipped"] += 1
+        self.stats["ticks"] += 1
+        self.reminded = {key for key in self.reminded if key[1] > now}
+        horizon = now + self.remind_before + timedelta(seconds=self.archive_interval)
+        upcoming = await self.call(self.storage.search_events, now, horizon, None, REFILL_LIMIT)
+        for event in upcoming:
+            self.schedule(event)
+
+    async def run(self):
+        next_tick = datetime.now()
+        while not self.closing:
+            now = datetime.now()
+            if now >= next_tick:
+                try:
+                    await self.tick()
+                except Exception:
+                    logger.exception("event archive tick failed")
+                next_tick = now + timedelta(seconds=self.archive_interval)
+            while self.reminders and self.reminders[0][0] <= datetime.now():
+                _, id, date = heapq.heappop(self.reminders)
+                self.scheduled.discard((id, date))
+                try:
+                    await self.remind(id, date)
+                except Exception:
+                    logger.exception("queueing reminders for event %s failed", id)
+            wake_at = min(next_tick, self.reminders[0][0]) if self.reminders else next_tick
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max((wake_at - datetime.now()).total_seconds(), 0))
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    async def remind(self, id: int, date: datetime):
+        event = await self.call(self.storage.get_event, id)
+        # deleted or rescheduled since it was queued; a moved event has its own entry
+        if event is None or event.date != date:
+            return
+        self.reminded.add((id, date))
+        # another worker scheduled the same event and got there first
+        if not await self.call(self.storage.claim_reminder, id, date):
+            return
+        offset = 0
+        while True:
+            result = await self.call(self.storage.attendees, id, offset, ATTENDEES_PAGE)
+            if result is None:
+                return
+            _, _, emails = result
+            for email in emails:
+                self.outbox.put_nowait((email, event.title, event.date))
+            self.stats["reminders_queued"] += len(emails)
+            if len(emails) < ATTENDEES_PAGE:
+                return
+            offset += ATTENDEES_PAGE
+
+    async def send_reminders(self):
+        while True:
+            email, title, date = await self.outbox.get()
+            if email is None:
+                return
+            logger.info(f"Reminder to {email}: '{title}' starts at {date:%Y-%m-%d %H:%M}")
+            self.stats["reminders_sent"] += 1
+
+    def metrics(self):
+        return {**self.stats, "pending_reminders": len(self.reminders), "outbox": self.outbox.qsize()}
+
+    async def close(self):
+        # stop through a flag: cancelling the loop inside wait_for can be swallowed
+        self.closing = True
+        self.wakeup.set()
+        self.outbox.put_nowait((None, None, None))
+        await asyncio.gather(*self.tasks)
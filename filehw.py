@@ -1,28 +1,200 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, File, UploadFile
+from fastapi import FastAPI, HTTPException, BackgroundTasks, File, Request, UploadFile
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from fastapi.responses import JSONResponse
 from fastapi.testclient import TestClient
 import uvicorn
 from PIL import Image
+import asyncio
 import io
+import os
+import tarfile
+import time
+import uuid
+import zipfile
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from contextlib import asynccontextmanager
+from loopmonitor import install_from_env
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pillow drops the GIL while it decodes and encodes, so conversions spread over the cores
+    app.state.executor = ThreadPoolExecutor(max_workers=PHOTO_WORKERS, thread_name_prefix="convert")
+    try:
+        yield
+    finally:
+        app.state.executor.shutdown(wait=True)
+
+
+app = FastAPI(lifespan=lifespan)
 client = TestClient(app)
 
 MAX_FILE_SIZE = 5 * 1024 * 1024
 ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/jpg", "image/png"}
 SAVE_PATH = "converted_image.jpg"
+BATCH_DIR = Path(os.getenv("PHOTO_BATCH_DIR", "converted"))
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", os.cpu_count() or 2))
+MAX_BATCH_FILES = 10_000
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
 
 
-async def edit_format(contents: bytes, path: str):
+def convert_to_jpeg(contents: bytes) -> bytes:
     image = Image.open(io.BytesIO(contents)).convert("RGB")
     output = io.BytesIO()
     image.save(output, format="JPEG")
-    output.seek(0)
+    return output.getvalue()
+
+
+async def edit_format(contents: bytes, path: str):
+    jpeg = await asyncio.get_running_loop().run_in_executor(app.state.executor, convert_to_jpeg, contents)
 
     with open(path, "wb") as f:
-        f.write(output.read())
+        f.write(jpeg)
+
+def convert_file(contents: bytes, path: Path) -> int:
+    jpeg = convert_to_jpeg(contents)
+    path.write_bytes(jpeg)
+    return len(jpeg)
+
+
+def output_path(batch_dir: Path, index: int, name: str) -> Path:
+    return batch_dir / f"{index:05d}_{Path(name).stem or 'image'}.jpg"
+
+
+class BatchPipeline:
+    def __init__(self):
+        self.batch = uuid.uuid4().hex
+        self.dir = BATCH_DIR / self.batch
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.loop = asyncio.get_running_loop()
+        # bounds how many decoded files wait in memory for a worker
+        self.slots = asyncio.Semaphore(PHOTO_WORKERS * 2)
+        self.tasks = []
+        self.files = []
+        self.started = time.perf_counter()
+
+    def skip(self, name: str, reason: str):
+        self.files.append({"filename": name, "status": "skipped", "error": reason})
+
+    async def submit(self, name: str, contents: bytes):
+        entry = {"filename": name, "status": "pending", "size": len(contents)}
+        self.files.append(entry)
+        await self.slots.acquire()
+        self.tasks.append(asyncio.create_task(self.convert(entry, contents, output_path(self.dir, len(self.files), name))))
+
+    async def convert(self, entry: dict, contents: bytes, path: Path):
+        try:
+            entry["converted_size"] = await self.loop.run_in_executor(app.state.executor, convert_file, contents, path)
+            entry["status"] = "converted"
+            entry["output"] = str(path)
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+        finally:
+            self.slots.release()
+
+    async def manifest(self) -> dict:
+        await asyncio.gather(*self.tasks)
+        seconds = time.perf_counter() - self.started
+        counts = {status: sum(1 for entry in self.files if entry["status"] == status)
+                  for status in ("converted", "failed", "skipped")}
+        return {
+            "batch": self.batch,
+            **counts,
+            "seconds": round(seconds, 3),
+            "images_per_second": round(counts["converted"] / seconds, 1) if seconds else None,
+            "files": self.files,
+        }
+
+
+def zip_members(fileobj):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            if info.file_size > MAX_FILE_SIZE:
+                yield info.filename, None
+                continue
+            with archive.open(info) as member:
+                yield info.filename, member.read(MAX_FILE_SIZE + 1)
+
+
+def tar_members(fileobj):
+    # "r|*" reads the tar as a stream, one member at a time, whatever the compression
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            if info.size > MAX_FILE_SIZE:
+                yield info.name, None
+                continue
+            yield info.name, archive.extractfile(info).read()
+
+
+def archive_members(file: UploadFile):
+    name = (file.filename or "").lower()
+    if name.endswith(".zip") or file.content_type in {"application/zip", "application/x-zip-compressed"}:
+        return zip_members(file.file)
+    if tarfile.is_tarfile(file.file):
+        file.file.seek(0)
+        return tar_members(file.file)
+    file.file.seek(0)
+    if zipfile.is_zipfile(file.file):
+        file.file.seek(0)
+        return zip_members(file.file)
+    raise HTTPException(status_code=400, detail="archive must be zip or tar")
+
+
+@app.post("/photos/batch")
+async def photo_batch(request: Request):
+    # parsed here: a File(...) parameter goes through Starlette's default limit of 1000 files
+    form = await request.form(max_files=MAX_BATCH_FILES)
+    files = [file for file in form.getlist("files") if isinstance(file, StarletteUploadFile)]
+    if not files:
+        raise HTTPException(status_code=400, detail="no files")
+
+    pipeline = BatchPipeline()
+    for file in files:
+        if file.content_type not in ALLOWED_CONTENT_TYPES:
+            pipeline.skip(file.filename, "format doesn't exist")
+            continue
+        contents = await file.read()
+        if len(contents) > MAX_FILE_SIZE:
+            pipeline.skip(file.filename, "file is too big")
+            continue
+        await pipeline.submit(file.filename, contents)
+    return await pipeline.manifest()
+
+
+@app.post("/photos/archive")
+async def photo_archive(file: UploadFile = File(...)):
+    # the upload is spooled to a temporary file; members are read from it one by one
+    members = await asyncio.to_thread(archive_members, file)
+    pipeline = BatchPipeline()
+    count = 0
+    try:
+        while True:
+            member = await asyncio.to_thread(next, members, None)
+            if member is None:
+                break
+            name, contents = member
+            count += 1
+            if count > MAX_BATCH_FILES:
+                raise HTTPException(status_code=413, detail=f"at most {MAX_BATCH_FILES} files per archive")
+            if Path(name).suffix.lower() not in IMAGE_EXTENSIONS:
+                pipeline.skip(name, "format doesn't exist")
+            elif contents is None or len(contents) > MAX_FILE_SIZE:
+                pipeline.skip(name, "file is too big")
+            else:
+                await pipeline.submit(name, contents)
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise HTTPException(status_code=400, detail=f"broken archive: {e}")
+    finally:
+        await asyncio.gather(*pipeline.tasks)
+    return await pipeline.manifest()
+
 
 @app.post("/photo")
 async def photo(backgroundtasks: BackgroundTasks, file: UploadFile = File(...)):
@@ -45,7 +217,7 @@ async def photo(backgroundtasks: BackgroundTasks, file: UploadFile = File(...)):
 
 
 def test_upload_file_success() -> None:
-    with open("test_file_supported_format.jpg", "rb") as f:
+    with client, open("test_file_supported_format.jpg", "rb") as f:
         expected_size = len(f.read())
         f.seek(0)
         response = client.post(
@@ -63,7 +235,7 @@ def test_upload_file_success() -> None:
 
 
 def test_upload_file_not_supported_format() -> None:
-    with open("test_file_unsupported_format.webp", "rb") as f:
+    with client, open("test_file_unsupported_format.webp", "rb") as f:
         response = client.post(
             "/photo",
             files={"file": f},
@@ -73,5 +245,40 @@ def test_upload_file_not_supported_format() -> None:
     assert response.json() == {"detail": "format doesn't exist"}
 
 
+def test_upload_archive_manifest() -> None:
+    images = []
+    for color in ("red", "green"):
+        output = io.BytesIO()
+        Image.new("RGB", (32, 32), color).save(output, format="PNG")
+        images.append(output.getvalue())
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("red.png", images[0])
+        zf.writestr("photos/green.png", images[1])
+        zf.writestr("notes.txt", b"not an image")
+        zf.writestr("broken.jpg", b"not a jpeg")
+
+    with client:
+        response = client.post("/photos/archive", files={"file": ("photos.zip", archive.getvalue(), "application/zip")})
+
+    assert response.status_code == 200
+    manifest = response.json()
+    assert (manifest["converted"], manifest["failed"], manifest["skipped"]) == (2, 1, 1)
+    assert [entry["status"] for entry in manifest["files"]] == ["converted", "converted", "skipped", "failed"]
+
+
+def test_upload_batch_over_form_default_limit() -> None:
+    files = [("files", (f"note-{i}.txt", b"not an image", "text/plain")) for i in range(1001)]
+
+    with client:
+        response = client.post("/photos/batch", files=files)
+
+    assert response.status_code == 200
+    assert response.json()["skipped"] == 1001
+
+
+install_from_env(app)
+
+
 if __name__ == "__main__":
     uvicorn.run("filehw:app", reload=True, port=1488)
@@ -1,8 +1,57 @@
 from fastapi import FastAPI, HTTPException, Path, Query, Header
+from pydantic import BaseModel, Field
 import uvicorn
+import os
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 
-app = FastAPI()
+from ping_store import PingWriter
+from loopmonitor import install_from_env
+
+PING_DB_PATH = os.getenv("PING_DB_PATH", "pings.db")
+MAX_BATCH_PINGS = 10_000
+
+
+class Ping(BaseModel):
+    user_id: int = Field(..., description="user id")
+    timestamp: datetime | None = Field(None, description="time")
+    version: str | None = Field(None, description="client version, defaults to the X-Client-Version header")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.pings = PingWriter(PING_DB_PATH)
+    await app.state.pings.start()
+    try:
+        yield
+    finally:
+        await app.state.pings.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.post("/index/batch")
+async def index_batch(
+    pings: list[Ping],
+    X_Client_Version: str = Header(alias="X-Client-Version")
+):
+    if len(pings) > MAX_BATCH_PINGS:
+        raise HTTPException(status_code=413, detail=f"at most {MAX_BATCH_PINGS} pings per batch")
+
+    now = time.time()
+    writer = app.state.pings
+    await writer.make_room(len(pings))
+    accepted = 0
+    for ping in pings:
+        accepted += writer.add(
+            ping.user_id,
+            ping.version or X_Client_Version,
+            ping.timestamp.timestamp() if ping.timestamp is not None else now,
+        )
+    return {"accepted": accepted, "rejected": len(pings) - accepted}
+
 
 @app.post("/index/{user_id}")
 async def index(
@@ -12,39 +61,58 @@ async def index(
 ):
     if timestamp is None:
         timestampp = datetime.now()
+        app.state.pings.add(user_id, X_Client_Version, timestampp.timestamp())
         return {
             "user_id": user_id,
             "X-Client-Version": X_Client_Version,
             "timestamp": timestampp
         }
 
+    if not app.state.pings.add(user_id, X_Client_Version, timestamp.timestamp()):
+        raise HTTPException(status_code=400, detail="timestamp is in the future")
     return {
         "user_id": user_id,
         "X-Client-Version": X_Client_Version,
         "timestamp": timestamp
     }
 
-if __name__ == "__main__":
-    uvicorn.run("fivehm:app", reload=True)
 
-import uvicorn
-from datetime import datetime
+def minute_range(since: datetime | None, until: datetime | None) -> tuple[int, int]:
+    last = int((until.timestamp() if until is not None else time.time()) // 60)
+    first = int(since.timestamp() // 60) if since is not None else last - 59
+    return first, last
 
 
-app = FastAPI()
+@app.get("/rollups/minutes")
+async def active_per_minute(
+    since: datetime = Query(None, description="start of the range, last hour by default"),
+    until: datetime = Query(None, description="end of the range, now by default"),
+    version: str = Query(None, description="only users of this client version")
+):
+    writer = app.state.pings
+    first, last = minute_range(since, until)
+    if version is None:
+        return await writer.query(writer.minutes, first, last)
+    return await writer.query(writer.minutes, first, last, version)
 
 
-@app.post("/index/{user_id}")
-async def index(user_id:int = Path(...,description="user id"),
-                timestamp:datetime = Query(None, description="time"),
-                X_Client_Version: str = Header(alias="X-Client-Version")):
-    if timestamp is None:
-        timestampp = datetime.now()
-        return {"user_id":user_id, "X-Client-Version":X_Client_Version, "timestamp":timestampp}
+@app.get("/rollups/versions")
+async def active_per_version(
+    since: datetime = Query(None, description="start of the range, last hour by default"),
+    until: datetime = Query(None, description="end of the range, now by default")
+):
+    writer = app.state.pings
+    first, last = minute_range(since, until)
+    return await writer.query(writer.by_version, first, last)
+
+
+@app.get("/rollups/stats")
+async def ingest_stats():
+    writer = app.state.pings
+    return {**writer.stats, "buffered": len(writer.buffer)}
+
 
-    return {"user_id":user_id,
-            "X-Client-Version":X_Client_Version,
-            "timestamp":timestamp}
+install_from_env(app)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+import asyncio
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MINIMUM_SIZE = 1024
+# above this size the faster level is used, so CPU per response stays bounded
+LARGE_SIZE = 1024 * 1024
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+
+class GzipEncoder:
+    name = "gzip"
+    # roughly where compressing starts to cost a millisecond of CPU; below that the thread hop costs more
+    offload_size = 128 * 1024
+
+    def __init__(self, large: bool = False):
+        self.compressor = zlib.compressobj(4 if large else 6, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush()
+
+
+class BrotliEncoder:
+    name = "br"
+    offload_size = 128 * 1024
+
+    def __init__(self, large: bool = False):
+        self.compressor = brotli.Compressor(quality=3 if large else 5)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self.compressor.process(data) + self.compressor.finish()
+
+
+class ZstdEncoder:
+    name = "zstd"
+    offload_size = 1024 * 1024
+
+    def __init__(self, large: bool = False):
+        self.compressor = zstandard.ZstdCompressor(level=1 if large else 3).compressobj()
+
+    def chunk(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush()
+
+
+# server preference when the client accepts several with the same q-value
+ENCODERS = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+PREFERENCE = ("zstd", "br", "gzip")
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for name in PREFERENCE:
+        q = weights.get(name, weights.get("*", 0.0))
+        if name in ENCODERS and q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def header_value(headers, name: bytes) -> bytes | None:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = header_value(scope["headers"], b"accept-encoding")
+        encoding = choose_encoding(accept_encoding.decode("latin-1")) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder = None
+
+        async def compress_send(message):
+            nonlocal start_message, encoder
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None:
+                headers = start_message["headers"]
+                content_type = (header_value(headers, b"content-type") or b"").decode("latin-1")
+                eligible = (
+                    header_value(headers, b"content-encoding") is None
+                    and content_type.startswith(COMPRESSIBLE_TYPES)
+                    and (more_body or len(body) >= self.minimum_size)
+                )
+                if not eligible:
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+
+                encoder = ENCODERS[encoding](large=len(body) >= LARGE_SIZE)
+                headers = [(key, value) for key, value in headers if key.lower() != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode("latin-1")))
+                headers.append((b"vary", b"Accept-Encoding"))
+                if not more_body:
+                    body = await self.run(encoder, encoder.finish, body)
+                    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+                    await send({**start_message, "headers": headers})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send({**start_message, "headers": headers})
+
+            body = await self.run(encoder, encoder.chunk if more_body else encoder.finish, body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, compress_send)
+
+    async def run(self, encoder, function, body: bytes) -> bytes:
+        # big payloads are compressed on a thread; zlib, brotli and zstd release the GIL while they work
+        if len(body) >= encoder.offload_size:
+            return await asyncio.to_thread(function, body)
+        return function(body)
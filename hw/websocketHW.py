@@ -8,7 +8,14 @@ from fastapi import (
     WebSocketDisconnect,
     status,
 )
+import asyncio
+import json
+import sys
+import time
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import aiosqlite
 import base64
 from fastapi.templating import Jinja2Templates
@@ -21,17 +28,30 @@ from fastapi.security import (
     OAuth2PasswordRequestForm,
     HTTPBasicCredentials
 )
-from websockethwdb import hash_password, check_password, create_tables, get_db
+from websockethwdb import hash_password, check_password, create_tables, get_db, open_db, MessageWriter, SQLITE_DB_NAME
+from websocketframes import MSGPACK_SUBPROTOCOL, Outgoing, choose_subprotocol, encode_binary, encode_text
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BASE_DIR))
+from rate_limit import create_login_throttle
+from loopmonitor import install_from_env
+from db_maintenance import DatabaseMaintenance, install as install_db_admin
+
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 security = HTTPBasic()
 
-app = FastAPI(on_startup=(create_tables,))
+REPLAY_PAGE_SIZE = 100
+REPLAY_LIMIT = 1000
+HEARTBEAT_INTERVAL = 15
+IDLE_TIMEOUT = 45
+OUTBOUND_BUFFER_LIMIT = 256 * 1024
+COALESCE_DELAY = 0.005
+PING_FRAME = Outgoing({"type": "ping"})
+PONG_FRAME = json.dumps({"type": "pong"}, separators=(",", ":"))
 
 
 class User(BaseModel):
@@ -44,25 +64,176 @@ class Token(BaseModel):
     access_token: str = Field(description="token value", examples=["#3HM4J24V324kljn2"])
 
 
+class Client:
+    def __init__(self, websocket: WebSocket, subprotocol: str | None = None):
+        self.websocket = websocket
+        self.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        self.outbox: deque[Outgoing] = deque()
+        self.outbox_size = 0
+        self.ready = asyncio.Event()
+        self.last_seen = time.monotonic()
+        self.sender: asyncio.Task | None = None
+
+    def enqueue(self, frame: Outgoing) -> bool:
+        if self.outbox_size + frame.size > OUTBOUND_BUFFER_LIMIT:
+            return False
+        self.outbox.append(frame)
+        self.outbox_size += frame.size
+        self.ready.set()
+        return True
+
+    def drop_replayed(self, last_id: int):
+        # live messages queued while the history was read may already be in it
+        self.outbox = deque(
+            frame for frame in self.outbox
+            if frame.payload["type"] != "message" or frame.payload["id"] > last_id
+        )
+        self.outbox_size = sum(frame.size for frame in self.outbox)
+
+    async def send(self, frames: list[Outgoing]):
+        if self.binary:
+            await self.websocket.send_bytes(encode_binary(frames))
+        else:
+            await self.websocket.send_text(encode_text(frames))
+
+    async def send_loop(self):
+        while True:
+            await self.ready.wait()
+            if COALESCE_DELAY:
+                await asyncio.sleep(COALESCE_DELAY)
+            self.ready.clear()
+            frames = list(self.outbox)
+            self.outbox.clear()
+            self.outbox_size = 0
+            try:
+                await self.send(frames)
+            except Exception:
+                return
+
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connection: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connection.append(websocket)
+        self.active_connection: dict[WebSocket, Client] = {}
+        self.stats = {"connected": 0, "disconnected": 0, "reaped_idle": 0, "reaped_overflow": 0}
+        self.heartbeat_task: asyncio.Task | None = None
+
+    async def connect(self, websocket: WebSocket, last_id: int | None = None):
+        subprotocol = choose_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        client = Client(websocket, subprotocol)
+        # registered before the replay so nothing published meanwhile falls between history and live frames
+        self.active_connection[websocket] = client
+        self.stats["connected"] += 1
+        if last_id is not None:
+            client.drop_replayed(await self.replay(client, last_id))
+        if self.active_connection.get(websocket) is client:
+            client.sender = asyncio.create_task(client.send_loop())
+
+    async def replay(self, client: Client, last_id: int) -> int:
+        last_id = max(last_id, await message_writer.newest_id() - REPLAY_LIMIT)
+        while True:
+            messages = await message_writer.fetch(last_id, REPLAY_PAGE_SIZE)
+            if not messages:
+                return last_id
+            await client.send([Outgoing({"type": "history", "messages": messages})])
+            last_id = messages[-1]["id"]
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connection.remove(websocket)
+        client = self.active_connection.pop(websocket, None)
+        if client is not None:
+            if client.sender is not None:
+                client.sender.cancel()
+            self.stats["disconnected"] += 1
+
+    def touch(self, websocket: WebSocket):
+        client = self.active_connection.get(websocket)
+        if client is not None:
+            client.last_seen = time.monotonic()
+
+    def reap(self, client: Client, reason: str):
+        if self.active_connection.pop(client.websocket, None) is None:
+            return
+        if client.sender is not None:
+            client.sender.cancel()
+        self.stats[f"reaped_{reason}"] += 1
+        asyncio.create_task(self.close_quietly(client.websocket))
+
+    async def close_quietly(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1001)
+        except RuntimeError:
+            pass
 
     async def send_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connection:
-            await connection.send_text(message)
+    def broadcast(self, message: Outgoing):
+        for client in list(self.active_connection.values()):
+            if not client.enqueue(message):
+                self.reap(client, "overflow")
+
+    def publish(self, client_id: int, text: str):
+        # the receive loop never waits for SQLite; deliver() broadcasts once the batch is stored
+        message_writer.add(client_id, text)
+
+    def deliver(self, messages: list[dict]):
+        # broadcast only once stored, so the id is final and a replay can never miss it;
+        # clients only read id and text, client_id and created stay in the database and the history
+        for message in messages:
+            self.broadcast(Outgoing({"type": "message", "id": message["id"], "text": message["text"]}))
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            deadline = time.monotonic() - IDLE_TIMEOUT
+            for client in list(self.active_connection.values()):
+                if client.last_seen < deadline:
+                    self.reap(client, "idle")
+                elif not client.enqueue(PING_FRAME):
+                    self.reap(client, "overflow")
+
+    async def start(self):
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+
+    async def stop(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+
+    def metrics(self):
+        return {
+            "live": len(self.active_connection),
+            "outbound_buffered": sum(c.outbox_size for c in self.active_connection.values()),
+            **self.stats,
+        }
 
 manager = ConnectionManager()
+message_writer = MessageWriter(on_stored=manager.deliver)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await create_tables()
+    app.state.db = await open_db()
+    app.state.login_throttle = create_login_throttle()
+    # bcrypt hashing takes tens of milliseconds, keep it off the event loop
+    app.state.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bcrypt")
+    await message_writer.start()
+    await manager.start()
+    app.state.maintenance = DatabaseMaintenance(SQLITE_DB_NAME)
+    await app.state.maintenance.start()
+    try:
+        yield
+    finally:
+        await app.state.maintenance.close()
+        await manager.stop()
+        await message_writer.close()
+        app.state.executor.shutdown(wait=True)
+        app.state.login_throttle.close()
+        await app.state.db.close()
+
+
+app = FastAPI(lifespan=lifespan)
+install_db_admin(app)
 
 
 async def get_user(
@@ -88,7 +259,9 @@ async def register(user: User, connection: aiosqlite.Connection = Depends(get_db
         if db_user:
             raise HTTPException(status.HTTP_400_BAD_REQUEST, "User with this email exists")
 
-        hashed_pwd = hash_password(user.password.get_secret_value())
+        hashed_pwd = await asyncio.get_running_loop().run_in_executor(
+            app.state.executor, hash_password, user.password.get_secret_value()
+        )
         websocket_token = str(uuid.uuid4())
 
         await cursor.execute(
@@ -102,9 +275,11 @@ async def register(user: User, connection: aiosqlite.Connection = Depends(get_db
 
 @app.post("/token", response_model=Token)
 async def login(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     connection: aiosqlite.Connection = Depends(get_db),
 ):
+    await request.app.state.login_throttle.check(request, form_data.username)
     async with connection.cursor() as cursor:
         await cursor.execute("SELECT * FROM users WHERE email = ?", (form_data.username,))
         user = await cursor.fetchone()
@@ -112,7 +287,9 @@ async def login(
     if not user:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "User not found")
 
-    if not check_password(form_data.password, user["password"]):
+    if not await asyncio.get_running_loop().run_in_executor(
+        app.state.executor, check_password, form_data.password, user["password"]
+    ):
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Incorrect password")
 
     return {
@@ -123,31 +300,51 @@ async def login(
 
 @app.get("/")
 async def get(request: Request):
-    return templates.TemplateResponse("websocket.html", {"request": request})
+    return templates.TemplateResponse(request, "websocket.html", {"root_path": request.scope.get("root_path", "")})
+
+@app.get("/metrics/connections")
+async def connection_metrics():
+    return manager.metrics()
 
 @app.websocket("/ws/{client_id}")
-async def ws(websocket: WebSocket, client_id: int, connection: aiosqlite.Connection = Depends(get_db)):
+async def ws(websocket: WebSocket, client_id: int):
     token = websocket.query_params.get("token")
     if not token:
         await websocket.close(code=1008, reason="Missing token")
         raise HTTPException(status_code=404, detail="not websocket token")
 
-    async with connection.cursor() as cursor:
-        await cursor.execute("SELECT * FROM users WHERE websocket_token = ?", (token,))
+    async with websocket.app.state.db.execute("SELECT id FROM users WHERE websocket_token = ?", (token,)) as cursor:
         user = await cursor.fetchone()
 
-        if not user:
-            raise HTTPException(status_code=404, detail="no user")
+    if not user:
+        raise HTTPException(status_code=404, detail="no user")
 
-    await manager.connect(websocket)
+    last_id = websocket.query_params.get("last_id")
     try:
+        await manager.connect(websocket, int(last_id) if last_id and last_id.isdigit() else None)
         while True:
             data = await websocket.receive_text()
-            await manager.broadcast(f"Клієнт #{client_id} написав: {data}")
+            manager.touch(websocket)
+            if data == PONG_FRAME:
+                continue
+            manager.publish(client_id, f"Клієнт #{client_id} написав: {data}")
     except WebSocketDisconnect:
+        pass
+    finally:
+        # whatever ended the loop, the client leaves the broadcast list and its sender task stops
         manager.disconnect(websocket)
-        await manager.broadcast(f"Клієнт #{client_id} вийшов з чату")
+    manager.publish(client_id, f"Клієнт #{client_id} вийшов з чату")
+
+
+install_from_env(app)
 
 
 if __name__ == "__main__":
-    uvicorn.run("websocketHW:app", reload=True, port=8000)
\ No newline at end of file
+    uvicorn.run(
+        "websocketHW:app",
+        reload=True,
+        port=8000,
+        ws_ping_interval=HEARTBEAT_INTERVAL,
+        ws_ping_timeout=IDLE_TIMEOUT,
+        ws_per_message_deflate=True,
+    )
\ No newline at end of file
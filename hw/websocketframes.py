@@ -0,0 +1,60 @@
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = "msgpack"
+BATCH_PREFIX = '{"type":"batch","messages":['
+
+
+class Outgoing:
+    __slots__ = ("payload", "text", "size", "packed")
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.text = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+        # bytes on the wire, which is what the outbound buffer limit is about; Cyrillic is 2 bytes a letter
+        self.size = len(self.text.encode("utf-8"))
+        self.packed = None
+
+    def binary(self) -> bytes:
+        if self.packed is None:
+            self.packed = msgpack.packb(self.payload)
+        return self.packed
+
+
+def array_header(length: int) -> bytes:
+    if length < 16:
+        return bytes((0x90 | length,))
+    if length < 1 << 16:
+        return b"\xdc" + struct.pack(">H", length)
+    return b"\xdd" + struct.pack(">I", length)
+
+
+def encode_text(frames: list[Outgoing]) -> str:
+    if len(frames) == 1:
+        return frames[0].text
+    return BATCH_PREFIX + ",".join(frame.text for frame in frames) + "]}"
+
+
+def encode_binary(frames: list[Outgoing]) -> bytes:
+    if len(frames) == 1:
+        return frames[0].binary()
+    # {"type": "batch", "messages": [...]} built from already packed items
+    return (
+        b"\x82"
+        + msgpack.packb("type")
+        + msgpack.packb("batch")
+        + msgpack.packb("messages")
+        + array_header(len(frames))
+        + b"".join(frame.binary() for frame in frames)
+    )
+
+
+def choose_subprotocol(requested: list[str]) -> str | None:
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in requested:
+        return MSGPACK_SUBPROTOCOL
+    return None
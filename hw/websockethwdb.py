@@ -1,8 +1,14 @@
+import asyncio
+import logging
+import time
 import aiosqlite
 import bcrypt
+from fastapi import Request
 
 SQLITE_DB_NAME = "websockethw.db"
 
+logger = logging.getLogger(__name__)
+
 async def create_tables():
     async with aiosqlite.connect(SQLITE_DB_NAME) as connection:
         cursor: aiosqlite.Cursor = await connection.cursor()
@@ -17,18 +23,138 @@ async def create_tables():
             );
             """
         )
+        await cursor.execute(
+            """
+                CREATE TABLE IF NOT EXISTS Messages(
+                    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    client_id  INTEGER NOT NULL,
+                    text       TEXT NOT NULL,
+                    created    REAL NOT NULL
+            );
+            """
+        )
         await connection.commit()
         await connection.close()
 
 
 
 
-async def get_db():
-    async with aiosqlite.connect(SQLITE_DB_NAME) as connection:
-        connection.row_factory = aiosqlite.Row
-        yield connection
+async def open_db():
+    connection = await aiosqlite.connect(SQLITE_DB_NAME)
+    connection.row_factory = aiosqlite.Row
+    # fetch the pragma result so no statement is left open holding a read lock
+    await connection.execute_fetchall("PRAGMA journal_mode = WAL")
+    return connection
 
-        await connection.close()
+
+def get_db(request: Request) -> aiosqlite.Connection:
+    return request.app.state.db
+
+
+class MessageWriter:
+    def __init__(
+        self,
+        on_stored=None,
+        db_name: str = SQLITE_DB_NAME,
+        batch_size: int = 500,
+        retry_interval: float = 0.05,
+        max_attempts: int = 5,
+    ):
+        # called with every committed batch, ids included, in id order
+        self.on_stored = on_stored
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.attempts = 0
+        self.pending: list[dict] = []
+        self.connection: aiosqlite.Connection | None = None
+        self.task: asyncio.Task | None = None
+        self.closing = False
+        self.wakeup = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+
+    async def start(self):
+        self.connection = await aiosqlite.connect(self.db_name)
+        await self.connection.execute("PRAGMA journal_mode = WAL")
+        await self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.task = asyncio.create_task(self.run())
+
+    def add(self, client_id: int, text: str):
+        # returns at once; the message reaches on_stored after its batch is committed
+        self.pending.append({"client_id": client_id, "text": text, "created": time.time()})
+        self.wakeup.set()
+
+    async def run(self):
+        # messages that arrive while a batch is being written go out together in the next one
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("writing messages to %s failed (attempt %d)", self.db_name, self.attempts)
+                self.wakeup.set()
+                await asyncio.sleep(self.retry_interval)
+            if self.closing and not self.pending:
+                return
+
+    async def flush(self):
+        async with self.flush_lock:
+            while self.pending:
+                batch = self.pending[:self.batch_size]
+                try:
+                    last_id = await self.write(batch)
+                except Exception:
+                    self.attempts += 1
+                    if self.attempts >= self.max_attempts:
+                        self.attempts = 0
+                        del self.pending[:len(batch)]
+                        logger.error("dropped %d messages after %d failed writes", len(batch), self.max_attempts)
+                    raise
+                self.attempts = 0
+                del self.pending[:len(batch)]
+                stored = [{"id": id, **message} for id, message in enumerate(batch, last_id - len(batch) + 1)]
+                if self.on_stored is not None:
+                    self.on_stored(stored)
+
+    async def write(self, messages: list[dict]) -> int:
+        try:
+            await self.connection.executemany(
+                "INSERT INTO Messages (client_id, text, created) VALUES (:client_id, :text, :created)",
+                messages,
+            )
+            # the transaction holds the write lock, so no other worker can take ids in between
+            # and the batch got consecutive ids ending at last_insert_rowid()
+            async with self.connection.execute("SELECT last_insert_rowid()") as cursor:
+                (last_id,) = await cursor.fetchone()
+            await self.connection.commit()
+        except BaseException:
+            await self.connection.rollback()
+            raise
+        return last_id
+
+    async def newest_id(self) -> int:
+        async with self.connection.execute("SELECT max(id) FROM Messages") as cursor:
+            (last_id,) = await cursor.fetchone()
+        return last_id or 0
+
+    async def fetch(self, after_id: int, limit: int) -> list[dict]:
+        async with self.flush_lock:
+            async with self.connection.execute(
+                "SELECT id, client_id, text, created FROM Messages WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [{"id": id, "client_id": client_id, "text": text, "created": created} for id, client_id, text, created in rows]
+
+    async def close(self):
+        # stop through a flag so a batch that is being written is finished, not cancelled halfway
+        self.closing = True
+        self.wakeup.set()
+        if self.task is not None:
+            await self.task
+        await self.connection.close()
 
 
 def hash_password(password: str):
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import defaultdict, deque
+
+from fastapi import Header
+
+from db_maintenance import require_admin
+
+UNATTRIBUTED = "<unattributed>"
+
+
+class LoopMonitor:
+    def __init__(self, threshold: float = 0.1, interval: float = 0.025, max_blocks: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.loop_thread = None
+        self.beat = time.monotonic()
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.lag_count = 0
+        self.blocked_total = 0.0
+        self.endpoint_blocked = defaultdict(float)
+        self.endpoint_samples = defaultdict(int)
+        self.recent_blocks = deque(maxlen=max_blocks)
+        self.endpoints = {}
+        self.current_block = None
+        self.started = False
+        self.task = None
+        self.stopped = threading.Event()
+
+    def start(self, routes):
+        if self.started:
+            return
+        self.started = True
+        self.endpoints = {
+            route.endpoint.__code__: route.path
+            for route in routes
+            if hasattr(getattr(route, "endpoint", None), "__code__")
+        }
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        # fresh for every start, so a restarted app does not inherit a task from a loop that is gone
+        self.stopped = threading.Event()
+        self.task = asyncio.get_running_loop().create_task(self.measure_lag())
+        threading.Thread(target=self.watch, args=(self.stopped,), daemon=True, name="loop-monitor").start()
+
+    async def stop(self):
+        if not self.started:
+            return
+        self.started = False
+        self.stopped.set()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def measure_lag(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - start - self.interval, 0.0)
+            self.beat = now
+            self.lag_last = lag
+            self.lag_max = max(self.lag_max, lag)
+            self.lag_total += lag
+            self.lag_count += 1
+
+    def watch(self, stopped):
+        tick = self.threshold / 2
+        while not stopped.wait(tick):
+            stalled = time.monotonic() - self.beat - self.interval
+            if stalled > self.threshold:
+                self.sample(stalled, tick)
+            elif self.current_block is not None:
+                self.recent_blocks.append(self.current_block)
+                self.current_block = None
+
+    def sample(self, stalled, tick):
+        frame = sys._current_frames().get(self.loop_thread)
+        if frame is None:
+            return
+        endpoint = self.attribute(frame)
+        if self.current_block is None:
+            # the first sample also covers the time before the stall crossed the threshold
+            counted = stalled
+            self.current_block = {
+                "endpoint": endpoint,
+                "detected_at": time.time(),
+                "stack": traceback.format_stack(frame, limit=20),
+            }
+        else:
+            counted = tick
+        self.current_block["blocked_ms"] = round(stalled * 1000, 3)
+        self.blocked_total += counted
+        self.endpoint_blocked[endpoint] += counted
+        self.endpoint_samples[endpoint] += 1
+
+    def attribute(self, frame):
+        while frame is not None:
+            path = self.endpoints.get(frame.f_code)
+            if path is not None:
+                return path
+            frame = frame.f_back
+        return UNATTRIBUTED
+
+    def report(self):
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "loop_lag_ms": {
+                "last": round(self.lag_last * 1000, 3),
+                "max": round(self.lag_max * 1000, 3),
+                "mean": round(self.lag_total / self.lag_count * 1000, 3) if self.lag_count else 0.0,
+            },
+            "blocked_total_ms": round(self.blocked_total * 1000, 3),
+            "endpoints": {
+                endpoint: {"blocked_ms": round(blocked * 1000, 3), "samples": self.endpoint_samples[endpoint]}
+                for endpoint, blocked in sorted(self.endpoint_blocked.items(), key=lambda item: -item[1])
+            },
+            "recent_blocks": list(self.recent_blocks),
+        }
+
+
+class LoopMonitorMiddleware:
+    def __init__(self, app, monitor: LoopMonitor, routes):
+        self.app = app
+        self.monitor = monitor
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.app(scope, self.stop_on_shutdown(receive), send)
+            return
+        if not self.monitor.started and scope["type"] in ("http", "websocket"):
+            self.monitor.start(self.routes)
+        await self.app(scope, receive, send)
+
+    def stop_on_shutdown(self, receive):
+        async def wrapped():
+            message = await receive()
+            if message["type"] == "lifespan.shutdown":
+                await self.monitor.stop()
+            return message
+        return wrapped
+
+
+def install(app, threshold: float | None = None, path: str = "/admin/blocking"):
+    if threshold is None:
+        threshold = float(os.getenv("LOOP_MONITOR_THRESHOLD", "0.1"))
+    monitor = LoopMonitor(threshold=threshold, interval=min(0.025, threshold / 4))
+
+    async def blocking_report(x_admin_token: str | None = Header(None, alias="X-Admin-Token")):
+        require_admin(x_admin_token)
+        return monitor.report()
+
+    app.add_api_route(path, blocking_report, methods=["GET"], include_in_schema=False)
+    app.add_middleware(LoopMonitorMiddleware, monitor=monitor, routes=app.routes)
+    return monitor
+
+
+def install_from_env(app):
+    if os.getenv("LOOP_MONITOR") == "1":
+        return install(app)
+    return None
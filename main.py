@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import importlib
+import os
+import sys
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from pathlib import Path
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from starlette.routing import Mount
+
+BASE_DIR = Path(__file__).resolve().parent
+sys.path.extend(str(BASE_DIR / folder) for folder in ("u", "hw"))
+
+APPS = {
+    "book": ("/book", "book"),
+    "todo": ("/todo", "todo"),
+    "netflix": ("/netflix", "netflixhomework"),
+    "products": ("/products", "homework0606"),
+    "oauth": ("/oauth", "oauthhomework"),
+    "ping": ("/ping", "fivehm"),
+    "middleware": ("/middleware", "middlewareHW"),
+    "photo": ("/photo", "filehw"),
+    "chat": ("/chat", "websocketHW"),
+}
+
+# same values as HEARTBEAT_INTERVAL / IDLE_TIMEOUT in hw/websocketHW.py
+WS_PING_INTERVAL = 15
+WS_PING_TIMEOUT = 45
+
+
+class LazyApp:
+    def __init__(self, module_name: str):
+        self.module_name = module_name
+        self.app = None
+        self.lock = asyncio.Lock()
+        self.exit_stack = None
+        self.load_seconds = None
+
+    async def load(self):
+        async with self.lock:
+            if self.app is None:
+                start = time.perf_counter()
+                # importing pulls in Pillow, bcrypt, aiosqlite...; keep the loop free meanwhile
+                module = await asyncio.to_thread(importlib.import_module, self.module_name)
+                app = module.app
+                # mounted apps do not get lifespan events, so run their startup/shutdown here
+                await self.exit_stack.enter_async_context(app.router.lifespan_context(app))
+                self.load_seconds = time.perf_counter() - start
+                self.app = app
+        return self.app
+
+    async def __call__(self, scope, receive, send):
+        app = self.app or await self.load()
+        await app(scope, receive, send)
+
+
+def selected_apps():
+    names = os.getenv("LAUNCHER_APPS")
+    if not names:
+        return list(APPS)
+    names = [name.strip() for name in names.split(",") if name.strip()]
+    unknown = [name for name in names if name not in APPS]
+    if unknown:
+        raise RuntimeError(f"Unknown apps in LAUNCHER_APPS: {', '.join(unknown)}")
+    return names
+
+
+mounted = {name: LazyApp(APPS[name][1]) for name in selected_apps()}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with AsyncExitStack() as exit_stack:
+        for lazy_app in mounted.values():
+            lazy_app.exit_stack = exit_stack
+        if os.getenv("LAUNCHER_PRELOAD") == "1":
+            for lazy_app in mounted.values():
+                await lazy_app.load()
+        yield
+
+
+app = FastAPI(
+    title="Homework apps",
+    lifespan=lifespan,
+    routes=[Mount(APPS[name][0], app=lazy_app) for name, lazy_app in mounted.items()],
+)
+
+
+@app.get("/")
+async def index():
+    return {
+        name: {
+            "prefix": APPS[name][0],
+            "module": lazy_app.module_name,
+            "loaded": lazy_app.app is not None,
+            "load_ms": round(lazy_app.load_seconds * 1000, 1) if lazy_app.load_seconds is not None else None,
+        }
+        for name, lazy_app in mounted.items()
+    }
+
+
+@app.post("/load/{name}")
+async def load(name: str):
+    if name not in mounted:
+        raise HTTPException(status_code=404, detail="App not found")
+    await mounted[name].load()
+    return {"name": name, "load_ms": round(mounted[name].load_seconds * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every homework app in one process, mounted under path prefixes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--reload", action="store_true", help="development mode, single worker")
+    parser.add_argument("--apps", help="comma separated subset of: " + ", ".join(APPS))
+    parser.add_argument("--preload", action="store_true", help="import every app at startup instead of on first request")
+    args = parser.parse_args()
+
+    if args.reload and args.workers > 1:
+        parser.error("--reload runs a single worker")
+    # workers import main:app on their own, so the options travel through the environment
+    os.environ["WEB_CONCURRENCY"] = str(1 if args.reload else args.workers)
+    if args.apps:
+        os.environ["LAUNCHER_APPS"] = args.apps
+    if args.preload:
+        os.environ["LAUNCHER_PRELOAD"] = "1"
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=None if args.reload else args.workers,
+        reload=args.reload,
+        app_dir=str(BASE_DIR),
+        ws_ping_interval=WS_PING_INTERVAL,
+        ws_ping_timeout=WS_PING_TIMEOUT,
+        ws_per_message_deflate=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
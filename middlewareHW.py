@@ -1,23 +1,137 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
 import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
 from datetime import datetime
 
+from loopmonitor import install_from_env
+
 app = FastAPI()
 
 logger = logging.getLogger("middleware_logger")
 logging.basicConfig(level=logging.INFO)
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"request_method: {request.method}, url: {request.url}, time: {datetime.now()}")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+UNMATCHED_ROUTE = "<unmatched>"
+EXEMPT_PATHS = {"/metrics"}
+
+
+def path_in_app(scope) -> str:
+    # under a Mount, "path" still carries the mount prefix that "root_path" names
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        return path[len(root_path):] or "/"
+    return path
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.response_size = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.requests = defaultdict(int)
+        self.in_flight = 0
+
+    def render(self):
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being processed.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_requests_total Completed requests.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, code), value in self.requests.items():
+            lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{code}"}} {value}')
+
+        lines.append("# HELP http_request_duration_seconds Request latency per route.")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route), histogram in self.latency.items():
+            lines.extend(histogram.render("http_request_duration_seconds", f'method="{method}",route="{route}"'))
+
+        lines.append("# HELP http_response_size_bytes Response body size per route.")
+        lines.append("# TYPE http_response_size_bytes histogram")
+        for (method, route), histogram in self.response_size.items():
+            lines.extend(histogram.render("http_response_size_bytes", f'method="{method}",route="{route}"'))
+        return "\n".join(lines) + "\n"
+
 
-    if "X-Custom-Header" not in request.headers:
-        return JSONResponse(status_code=400, content="Missing X-Custom-Header")
+metrics = Metrics()
 
-    response = await call_next(request)
-    return response
+
+class RequestLoggingMiddleware:
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        logger.info(f"request_method: {scope['method']}, url: {scope['path']}, time: {datetime.now()}")
+
+        if path_in_app(scope) not in EXEMPT_PATHS and not any(
+            name == b"x-custom-header" for name, _ in scope["headers"]
+        ):
+            response = JSONResponse(status_code=400, content="Missing X-Custom-Header")
+            await response(scope, receive, send)
+            return
+
+        status_code = 500
+        body_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, body_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                body_size += len(message.get("body", b""))
+            await send(message)
+
+        self.metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.metrics.in_flight -= 1
+            route = scope.get("route")
+            route_path = getattr(route, "path", UNMATCHED_ROUTE)
+            method = scope["method"]
+            self.metrics.latency[(method, route_path)].observe(elapsed)
+            self.metrics.response_size[(method, route_path)].observe(body_size)
+            self.metrics.requests[(method, route_path, status_code)] += 1
+
+
+app.add_middleware(RequestLoggingMiddleware, metrics=metrics)
 
 
 @app.get("/")
@@ -32,5 +146,13 @@ async def public_page():
     return {"message": "second"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+install_from_env(app)
+
+
 if __name__ == "__main__":
-    uvicorn.run("middlewareHW:app", reload=True)
\ No newline at end of file
+    uvicorn.run("middlewareHW:app", reload=True)
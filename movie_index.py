@@ -0,0 +1,127 @@
+import numpy as np
+
+
+class SimilarityIndex:
+    # how much a shared director, a close release year and a close rating add to the score (max 3.0)
+    director_weight = 1.0
+    year_weight = 1.0
+    rating_weight = 1.0
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.alive = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.directors = np.full(capacity, -1, dtype=np.int32)
+        # deleted rows hold inf here, which scores -inf and sorts behind every live movie
+        self.years = np.full(capacity, np.inf, dtype=np.float32)
+        self.ratings = np.full(capacity, np.inf, dtype=np.float32)
+        self.rows = {}
+        self.director_codes = {}
+        self.first_year = None
+        self.last_year = None
+        self.last_id = 0
+
+    def load(self, conn):
+        self.__init__()
+        self.refresh(conn)
+
+    def refresh(self, conn) -> bool:
+        # picks up movies written by other workers or straight into the database; False means
+        # something was deleted behind our back and the index needs a load() rather than a guess
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id, director, release_year, rating FROM Movie WHERE id > ? ORDER BY id', (self.last_id,)
+        )
+        self.extend(cursor.fetchall())
+        cursor.execute('SELECT movies FROM CatalogStats WHERE id = 1')
+        movies = (cursor.fetchone() or (0,))[0]
+        return movies == self.alive
+
+    def grow(self, needed: int):
+        capacity = len(self.ids)
+        if self.size + needed <= capacity:
+            return
+        while capacity < self.size + needed:
+            capacity *= 2
+        extra = capacity - len(self.ids)
+        self.ids = np.concatenate([self.ids, np.zeros(extra, dtype=np.int64)])
+        self.directors = np.concatenate([self.directors, np.full(extra, -1, dtype=np.int32)])
+        self.years = np.concatenate([self.years, np.full(extra, np.inf, dtype=np.float32)])
+        self.ratings = np.concatenate([self.ratings, np.full(extra, np.inf, dtype=np.float32)])
+
+    def extend(self, rows: list[tuple]):
+        rows = [row for row in rows if row[0] not in self.rows]
+        if not rows:
+            return
+        self.grow(len(rows))
+        ids, directors, years, ratings = zip(*rows)
+        start, end = self.size, self.size + len(rows)
+        codes = self.director_codes
+        self.ids[start:end] = ids
+        self.directors[start:end] = [codes.setdefault(director, len(codes)) for director in directors]
+        self.years[start:end] = years
+        self.ratings[start:end] = ratings
+        self.rows.update(zip(ids, range(start, end)))
+        self.size = end
+        self.alive += len(rows)
+        self.last_id = max(self.last_id, max(ids))
+        self.first_year = min(years) if self.first_year is None else min(self.first_year, min(years))
+        self.last_year = max(years) if self.last_year is None else max(self.last_year, max(years))
+
+    def add(self, id: int, director: str, release_year: int, rating: float):
+        self.extend([(id, director, release_year, rating)])
+
+    def remove(self, id: int):
+        row = self.rows.pop(id, None)
+        if row is None:
+            return
+        self.directors[row] = -1
+        self.years[row] = np.inf
+        self.ratings[row] = np.inf
+        self.alive -= 1
+        if self.size > 1024 and self.alive < self.size // 2:
+            self.compact()
+
+    def compact(self):
+        live = np.isfinite(self.years[:self.size])
+        ids = self.ids[:self.size][live]
+        directors = self.directors[:self.size][live]
+        years = self.years[:self.size][live]
+        ratings = self.ratings[:self.size][live]
+        self.size = len(ids)
+        self.ids[:self.size] = ids
+        self.directors[:self.size] = directors
+        self.years[:self.size] = years
+        self.ratings[:self.size] = ratings
+        self.directors[self.size:] = -1
+        self.years[self.size:] = np.inf
+        self.ratings[self.size:] = np.inf
+        self.rows = {int(id): row for row, id in enumerate(ids)}
+
+    def similar(self, id: int, limit: int = 10) -> list[tuple[int, float]]:
+        row = self.rows.get(id)
+        if row is None:
+            return []
+        span = max(self.last_year - self.first_year, 1)
+        years = self.years[:self.size]
+        ratings = self.ratings[:self.size]
+
+        # in place over float32, one pass per feature; no NaN, which would make argpartition several times slower
+        score = years - self.years[row]
+        np.abs(score, out=score)
+        score *= np.float32(-self.year_weight / span)
+        distance = ratings - self.ratings[row]
+        np.abs(distance, out=distance)
+        distance *= np.float32(self.rating_weight / 10)
+        score -= distance
+        score += np.float32(self.year_weight + self.rating_weight)
+        np.add(score, np.float32(self.director_weight), out=score, where=self.directors[:self.size] == self.directors[row])
+        score[row] = -np.inf
+
+        count = min(limit, self.alive - 1)
+        if count <= 0:
+            return []
+        # only the best `count` rows get sorted
+        best = np.argpartition(score, self.size - count)[self.size - count:]
+        best = best[np.argsort(-score[best], kind="stable")]
+        return [(int(self.ids[i]), round(float(score[i]), 4)) for i in best]
@@ -1,26 +1,156 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from pydantic import BaseModel, Field, EmailStr, validator, ConfigDict, field_validator
 import uvicorn
+import asyncio
+import logging
 import sqlite3
+from contextlib import asynccontextmanager
+from loopmonitor import install_from_env
+from sqlitepool import SQLitePool
+from singleflight import SingleFlight
+from movie_index import SimilarityIndex
+from http_compression import CompressionMiddleware
+from db_maintenance import DatabaseMaintenance, install as install_db_admin
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
 
-def init_db():
-    connection = sqlite3.connect('netflix.db')
-    cursor = connection.cursor()
-    cursor.execute('''
+# every write to Movie keeps the aggregates in step, whoever makes it
+STATS_TRIGGERS = '''
+    CREATE TRIGGER IF NOT EXISTS movie_stats_insert AFTER INSERT ON Movie
+    BEGIN
+        INSERT INTO CatalogStats (id, movies, rating_sum) VALUES (1, 1, NEW.rating)
+            ON CONFLICT (id) DO UPDATE SET movies = movies + 1, rating_sum = rating_sum + NEW.rating;
+        INSERT INTO DirectorStats (director, movies, rating_sum) VALUES (NEW.director, 1, NEW.rating)
+            ON CONFLICT (director) DO UPDATE SET movies = movies + 1, rating_sum = rating_sum + NEW.rating;
+        INSERT INTO YearStats (release_year, movies, rating_sum) VALUES (NEW.release_year, 1, NEW.rating)
+            ON CONFLICT (release_year) DO UPDATE SET movies = movies + 1, rating_sum = rating_sum + NEW.rating;
+    END;
+    CREATE TRIGGER IF NOT EXISTS movie_stats_delete AFTER DELETE ON Movie
+    BEGIN
+        UPDATE CatalogStats SET movies = movies - 1, rating_sum = rating_sum - OLD.rating WHERE id = 1;
+        UPDATE DirectorStats SET movies = movies - 1, rating_sum = rating_sum - OLD.rating
+            WHERE director = OLD.director;
+        DELETE FROM DirectorStats WHERE director = OLD.director AND movies = 0;
+        UPDATE YearStats SET movies = movies - 1, rating_sum = rating_sum - OLD.rating
+            WHERE release_year = OLD.release_year;
+        DELETE FROM YearStats WHERE release_year = OLD.release_year AND movies = 0;
+    END;
+    CREATE TRIGGER IF NOT EXISTS movie_stats_update AFTER UPDATE OF director, release_year, rating ON Movie
+    BEGIN
+        UPDATE CatalogStats SET rating_sum = rating_sum - OLD.rating + NEW.rating WHERE id = 1;
+        UPDATE DirectorStats SET movies = movies - 1, rating_sum = rating_sum - OLD.rating
+            WHERE director = OLD.director;
+        DELETE FROM DirectorStats WHERE director = OLD.director AND movies = 0;
+        INSERT INTO DirectorStats (director, movies, rating_sum) VALUES (NEW.director, 1, NEW.rating)
+            ON CONFLICT (director) DO UPDATE SET movies = movies + 1, rating_sum = rating_sum + NEW.rating;
+        UPDATE YearStats SET movies = movies - 1, rating_sum = rating_sum - OLD.rating
+            WHERE release_year = OLD.release_year;
+        DELETE FROM YearStats WHERE release_year = OLD.release_year AND movies = 0;
+        INSERT INTO YearStats (release_year, movies, rating_sum) VALUES (NEW.release_year, 1, NEW.rating)
+            ON CONFLICT (release_year) DO UPDATE SET movies = movies + 1, rating_sum = rating_sum + NEW.rating;
+    END;
+'''
+
+STATS_BACKFILL = '''
+    DELETE FROM CatalogStats;
+    DELETE FROM DirectorStats;
+    DELETE FROM YearStats;
+    INSERT INTO CatalogStats (id, movies, rating_sum) SELECT 1, COUNT(*), COALESCE(SUM(rating), 0) FROM Movie;
+    INSERT INTO DirectorStats (director, movies, rating_sum)
+        SELECT director, COUNT(*), SUM(rating) FROM Movie GROUP BY director;
+    INSERT INTO YearStats (release_year, movies, rating_sum)
+        SELECT release_year, COUNT(*), SUM(rating) FROM Movie GROUP BY release_year;
+'''
+
+MAX_LEADERBOARD = 100
+
+
+def init_db(db: SQLitePool):
+    db.execute_script('''
         CREATE TABLE IF NOT EXISTS Movie (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
             director TEXT NOT NULL,
             release_year INTEGER NOT NULL,
             rating FLOAT NOT NULL
-        )
+        );
+        CREATE INDEX IF NOT EXISTS idx_movie_rating ON Movie(rating DESC, id);
+
+        CREATE TABLE IF NOT EXISTS CatalogStats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            movies INTEGER NOT NULL,
+            rating_sum FLOAT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS DirectorStats (
+            director TEXT PRIMARY KEY,
+            movies INTEGER NOT NULL,
+            rating_sum FLOAT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_director_rating ON DirectorStats(rating_sum / movies DESC, director);
+        CREATE INDEX IF NOT EXISTS idx_director_movies ON DirectorStats(movies DESC, director);
+        CREATE TABLE IF NOT EXISTS YearStats (
+            release_year INTEGER PRIMARY KEY,
+            movies INTEGER NOT NULL,
+            rating_sum FLOAT NOT NULL
+        );
     ''')
-    connection.commit()
-    connection.close()
+    conn = db.acquire()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'movie_stats_insert'")
+        if cursor.fetchone() is None:
+            # the aggregates are new for this database, so fill them from the movies already there
+            conn.executescript("BEGIN;" + STATS_BACKFILL + STATS_TRIGGERS + "COMMIT;")
+    finally:
+        db.release(conn)
+
+
+def load_similar(db):
+    conn = db.acquire()
+    try:
+        index = SimilarityIndex()
+        index.load(conn)
+        return index
+    finally:
+        db.release(conn)
 
-app = FastAPI(on_startup=[init_db])
+
+async def rebuild_similar():
+    try:
+        app.state.similar = await asyncio.to_thread(load_similar, app.state.db)
+    except Exception:
+        logger.exception("rebuilding the similarity index failed")
+
+
+def start_similar_rebuild():
+    # one rebuild at a time, off the loop; requests keep using the current index until it is swapped
+    task = app.state.similar_rebuild
+    if task is None or task.done():
+        task = app.state.similar_rebuild = asyncio.create_task(rebuild_similar())
+    return task
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.db = SQLitePool('netflix.db')
+    init_db(app.state.db)
+    app.state.similar = load_similar(app.state.db)
+    app.state.similar_rebuild = None
+    app.state.maintenance = DatabaseMaintenance('netflix.db')
+    await app.state.maintenance.start()
+    try:
+        yield
+    finally:
+        await app.state.maintenance.close()
+        if app.state.similar_rebuild is not None:
+            await app.state.similar_rebuild
+        app.state.db.close()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
+install_db_admin(app)
+movie_flights = SingleFlight("get_movie")
 
 class Movie(BaseModel):
     title: str = Field(..., description="Title of the movie")
@@ -33,7 +163,7 @@ class Movie(BaseModel):
 async def get_movies():
     conn = None
     try:
-        conn = sqlite3.connect('netflix.db')
+        conn = await app.state.db.acquire_async()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM Movie')
         rows = cursor.fetchall()
@@ -46,13 +176,13 @@ async def get_movies():
 
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
 
 @app.post("/movies", status_code=201)
 async def add_movie(movie:Movie):
     conn = None
     try:
-        conn = sqlite3.connect('netflix.db')
+        conn = await app.state.db.acquire_async()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
@@ -70,19 +200,19 @@ async def add_movie(movie:Movie):
             (movie.title, movie.director, movie.release_year, movie.rating)
         )
         conn.commit()
+        app.state.similar.add(cursor.lastrowid, movie.director, movie.release_year, movie.rating)
         return {"message": f"Movie '{movie.title}' was added"}
 
     except sqlite3.DatabaseError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
 
-@app.get("/movies/{id}")
-async def get_movie(id: int):
+def load_movie(id: int):
     conn = None
     try:
-        conn = sqlite3.connect('netflix.db')
+        conn = app.state.db.acquire()
         cursor = conn.cursor()
 
         cursor.execute('SELECT * FROM Movie WHERE id = ?', (id,))
@@ -96,13 +226,17 @@ async def get_movie(id: int):
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
+
+@app.get("/movies/{id}")
+async def get_movie(id: int):
+    return await movie_flights.run(id, load_movie, id)
 
 @app.delete("/movies/{id}")
 async def delete_movie(id:int):
     conn = None
     try:
-        conn = sqlite3.connect('netflix.db')
+        conn = await app.state.db.acquire_async()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
@@ -115,14 +249,172 @@ async def delete_movie(id:int):
 
         cursor.execute('DELETE FROM Movie WHERE id = ?', (id,))
         conn.commit()
+        app.state.similar.remove(id)
         return {"message": f"Movie '{row['title']}' was deleted"}
 
     except sqlite3.DatabaseError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
+
+@app.get("/movies/{id}/similar")
+async def similar_movies(id: int, limit: int = Query(10, ge=1, le=MAX_LEADERBOARD)):
+    conn = None
+    try:
+        conn = await app.state.db.acquire_async()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        index = app.state.similar
+        if not index.refresh(conn):
+            rebuild = start_similar_rebuild()
+            if id not in index.rows:
+                # it may be a movie the current index missed rather than a missing one; the rebuild
+                # takes a pooled connection of its own, so this one goes back while waiting
+                app.state.db.release(conn)
+                conn = None
+                await asyncio.shield(rebuild)
+                index = app.state.similar
+                conn = await app.state.db.acquire_async()
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+
+        if id not in index.rows:
+            raise HTTPException(status_code=404, detail="Movie not found")
+
+        scores = dict(index.similar(id, limit))
+        if not scores:
+            return []
+        cursor.execute(
+            f'SELECT id, title, director, release_year, rating FROM Movie WHERE id IN ({", ".join("?" * len(scores))})',
+            list(scores)
+        )
+        movies = {row['id']: dict(row) for row in cursor.fetchall()}
+        return [{**movies[movie_id], "score": score} for movie_id, score in scores.items() if movie_id in movies]
+
+    except sqlite3.DatabaseError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        if conn is not None:
+            app.state.db.release(conn)
+
+def average(rating_sum: float, movies: int):
+    return round(rating_sum / movies, 2) if movies else None
+
+
+@app.get("/stats/summary")
+async def catalog_stats():
+    conn = None
+    try:
+        conn = await app.state.db.acquire_async()
+        cursor = conn.cursor()
+        cursor.execute('SELECT movies, rating_sum FROM CatalogStats WHERE id = 1')
+        movies, rating_sum = cursor.fetchone() or (0, 0.0)
+        return {"movies": movies, "average_rating": average(rating_sum, movies)}
+
+    except sqlite3.DatabaseError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        if conn is not None:
+            app.state.db.release(conn)
+
+@app.get("/stats/top")
+async def top_rated(limit: int = Query(10, ge=1, le=MAX_LEADERBOARD)):
+    conn = None
+    try:
+        conn = await app.state.db.acquire_async()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        # walks idx_movie_rating from the top, so only `limit` rows are read
+        cursor.execute(
+            'SELECT id, title, director, release_year, rating FROM Movie ORDER BY rating DESC, id LIMIT ?',
+            (limit,)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    except sqlite3.DatabaseError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        if conn is not None:
+            app.state.db.release(conn)
+
+@app.get("/stats/directors")
+async def director_leaderboard(
+    sort: str = Query("rating", pattern="^(rating|movies)$", description="rating or movies"),
+    limit: int = Query(10, ge=1, le=MAX_LEADERBOARD)
+):
+    if sort == "rating":
+        order = "rating_sum / movies DESC, director"
+    else:
+        order = "movies DESC, director"
+    conn = None
+    try:
+        conn = await app.state.db.acquire_async()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT director, movies, rating_sum FROM DirectorStats ORDER BY {order} LIMIT ?', (limit,))
+        return [
+            {"director": director, "movies": movies, "average_rating": average(rating_sum, movies)}
+            for director, movies, rating_sum in cursor.fetchall()
+        ]
+
+    except sqlite3.DatabaseError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        if conn is not None:
+            app.state.db.release(conn)
+
+@app.get("/stats/directors/{director}")
+async def director_stats(director: str):
+    conn = None
+    try:
+        conn = await app.state.db.acquire_async()
+        cursor = conn.cursor()
+        cursor.execute('SELECT movies, rating_sum FROM DirectorStats WHERE director = ?', (director,))
+        row = cursor.fetchone()
+
+        if not row:
+            raise HTTPException(status_code=404, detail="Director not found")
+
+        movies, rating_sum = row
+        return {"director": director, "movies": movies, "average_rating": average(rating_sum, movies)}
+
+    except sqlite3.DatabaseError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        if conn is not None:
+            app.state.db.release(conn)
+
+@app.get("/stats/years")
+async def movies_per_year(
+    since: int = Query(None, description="first release year"),
+    until: int = Query(None, description="last release year")
+):
+    conn = None
+    try:
+        conn = await app.state.db.acquire_async()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT release_year, movies, rating_sum FROM YearStats '
+            'WHERE release_year BETWEEN ? AND ? ORDER BY release_year',
+            (since if since is not None else -1, until if until is not None else 1_000_000)
+        )
+        return [
+            {"release_year": year, "movies": movies, "average_rating": average(rating_sum, movies)}
+            for year, movies, rating_sum in cursor.fetchall()
+        ]
+
+    except sqlite3.DatabaseError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        if conn is not None:
+            app.state.db.release(conn)
+
+@app.get("/metrics/singleflight")
+async def singleflight_metrics():
+    return {"get_movie": movie_flights.metrics()}
+
 
+install_from_env(app)
 
 
 if __name__ == "__main__":
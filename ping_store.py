@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import defaultdict, deque
+
+ALL_VERSIONS = "*"
+# client clocks run a little ahead; anything later than this is refused rather than let it close the open minutes
+MAX_CLOCK_SKEW = 120
+
+logger = logging.getLogger(__name__)
+
+
+class PingWriter:
+    def __init__(
+        self,
+        path: str = "pings.db",
+        capacity: int = 200_000,
+        batch_size: int = 5_000,
+        flush_interval: float = 0.2,
+        rollup_window: int = 5,
+    ):
+        self.path = path
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # minutes kept in memory for exact distinct counts; older pings are stored but not rolled up
+        self.rollup_window = rollup_window
+        self.buffer = deque(maxlen=capacity)
+        self.active = defaultdict(set)
+        self.dirty = set()
+        # (minute, version, user_id) first seen by this worker since the last flush
+        self.members = []
+        self.newest_minute = 0
+        self.versions = {}
+        self.stats = {
+            "received": 0, "flushed": 0, "dropped": 0, "late": 0, "future": 0, "flushes": 0, "flush_errors": 0,
+        }
+        self.connection = None
+        self.task = None
+        self.closing = False
+        self.wakeup = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+
+    def create_tables(self):
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS Versions (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS Pings (
+                user_id INTEGER NOT NULL,
+                version_id INTEGER NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pings_ts ON Pings(ts);
+            CREATE TABLE IF NOT EXISTS ActiveMembers (
+                minute INTEGER NOT NULL,
+                version TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (minute, version, user_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS ActiveUsers (
+                minute INTEGER NOT NULL,
+                version TEXT NOT NULL,
+                users INTEGER NOT NULL,
+                PRIMARY KEY (minute, version)
+            ) WITHOUT ROWID;
+        ''')
+
+    def load(self):
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.create_tables()
+        self.versions = dict(self.connection.execute("SELECT name, id FROM Versions"))
+        # rebuild the open minutes so a restart does not lower their counts
+        since = (int(time.time()) // 60 - self.rollup_window) * 60
+        rows = self.connection.execute(
+            "SELECT p.user_id, v.name, p.ts FROM Pings p JOIN Versions v ON v.id = p.version_id WHERE p.ts >= ?",
+            (since,),
+        )
+        for user_id, version, ts in rows:
+            self.roll_up(user_id, version, int(ts) // 60)
+        # the first flush writes these members again (ignored if present) so an older database gets them too
+
+    async def start(self):
+        await asyncio.to_thread(self.load)
+        self.task = asyncio.create_task(self.run())
+
+    def add(self, user_id: int, version: str, ts: float) -> bool:
+        if ts > time.time() + MAX_CLOCK_SKEW:
+            self.stats["future"] += 1
+            return False
+        if len(self.buffer) == self.capacity:
+            self.stats["dropped"] += 1
+        self.buffer.append((user_id, version, ts))
+        self.stats["received"] += 1
+        self.roll_up(user_id, version, int(ts) // 60)
+        if len(self.buffer) >= self.batch_size:
+            self.wakeup.set()
+        return True
+
+    async def make_room(self, count: int):
+        # batch callers wait for the disk instead of overwriting unflushed pings
+        while len(self.buffer) + count > self.capacity:
+            await self.flush()
+
+    def roll_up(self, user_id: int, version: str, minute: int):
+        if minute > self.newest_minute:
+            self.newest_minute = minute
+            oldest = minute - self.rollup_window
+            for key in [key for key in self.active if key[0] < oldest]:
+                del self.active[key]
+        elif minute < self.newest_minute - self.rollup_window:
+            self.stats["late"] += 1
+            return
+        for key in ((minute, ALL_VERSIONS), (minute, version)):
+            users = self.active[key]
+            if user_id not in users:
+                users.add(user_id)
+                self.dirty.add(key)
+                self.members.append((*key, user_id))
+
+    async def run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # the batch is back in the buffer; try again on the next round
+                self.stats["flush_errors"] += 1
+                logger.exception("writing pings to %s failed", self.path)
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.buffer and not self.dirty:
+                return
+            batch = list(self.buffer)
+            self.buffer.clear()
+            members, self.members = self.members, []
+            keys = list(self.dirty)
+            self.dirty.clear()
+            try:
+                await asyncio.to_thread(self.write, batch, members, keys, self.newest_minute - self.rollup_window - 1)
+            except BaseException:
+                self.restore(batch, members, keys)
+                raise
+            self.stats["flushed"] += len(batch)
+            self.stats["flushes"] += 1
+
+    def restore(self, batch: list[tuple], members: list[tuple], keys: list[tuple]):
+        overflow = len(self.buffer) + len(batch) - self.capacity
+        if overflow > 0:
+            self.stats["dropped"] += overflow
+        self.buffer.extendleft(reversed(batch))
+        self.members[:0] = members
+        self.dirty.update(keys)
+
+    def version_id(self, cursor, name: str) -> int:
+        version_id = self.versions.get(name)
+        if version_id is None:
+            cursor.execute("INSERT OR IGNORE INTO Versions (name) VALUES (?)", (name,))
+            (version_id,) = cursor.execute("SELECT id FROM Versions WHERE name = ?", (name,)).fetchone()
+            self.versions[name] = version_id
+        return version_id
+
+    def write(self, batch: list[tuple], members: list[tuple], keys: list[tuple], oldest_minute: int):
+        cursor = self.connection.cursor()
+        try:
+            rows = [(user_id, self.version_id(cursor, version), ts) for user_id, version, ts in batch]
+            cursor.executemany("INSERT INTO Pings (user_id, version_id, ts) VALUES (?, ?, ?)", rows)
+            # every worker adds the users it saw to the shared sets, so the counts stay distinct across workers
+            cursor.executemany(
+                "INSERT OR IGNORE INTO ActiveMembers (minute, version, user_id) VALUES (?, ?, ?)", members
+            )
+            cursor.executemany(
+                "INSERT INTO ActiveUsers (minute, version, users) "
+                "SELECT ?, ?, COUNT(*) FROM ActiveMembers WHERE minute = ? AND version = ? "
+                "ON CONFLICT (minute, version) DO UPDATE SET users = excluded.users",
+                [(minute, version, minute, version) for minute, version in keys],
+            )
+            # closed minutes keep their count in ActiveUsers; their members are no longer needed
+            cursor.execute("DELETE FROM ActiveMembers WHERE minute < ?", (oldest_minute,))
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            # versions inserted by the failed transaction are gone again
+            self.versions = dict(self.connection.execute("SELECT name, id FROM Versions"))
+            raise
+
+    async def query(self, method, *args):
+        # reads share the writer's connection, so they wait for the flush in progress
+        await self.flush()
+        async with self.flush_lock:
+            return await asyncio.to_thread(method, *args)
+
+    def minutes(self, since: int, until: int, version: str = ALL_VERSIONS) -> list[dict]:
+        rows = self.connection.execute(
+            "SELECT minute, users FROM ActiveUsers WHERE version = ? AND minute BETWEEN ? AND ? ORDER BY minute",
+            (version, since, until),
+        ).fetchall()
+        return [{"minute": minute * 60, "active_users": users} for minute, users in rows]
+
+    def by_version(self, since: int, until: int) -> list[dict]:
+        rows = self.connection.execute(
+            "SELECT minute, version, users FROM ActiveUsers "
+            "WHERE version != ? AND minute BETWEEN ? AND ? ORDER BY minute, version",
+            (ALL_VERSIONS, since, until),
+        ).fetchall()
+        return [{"minute": minute * 60, "version": version, "active_users": users} for minute, version, users in rows]
+
+    async def close(self):
+        # stop the loop through a flag: cancelling it inside wait_for can be swallowed
+        self.closing = True
+        self.wakeup.set()
+        if self.task is not None:
+            await self.task
+        await self.flush()
+        self.connection.close()
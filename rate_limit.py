@@ -0,0 +1,148 @@
+import asyncio
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request, status
+
+
+class TokenBucketLimiter:
+    # whether hit() blocks and has to run off the event loop
+    offload = False
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def hit(self, key: str) -> float:
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+    def close(self):
+        self.buckets.clear()
+
+
+class SQLiteTokenBucketLimiter:
+    # BEGIN IMMEDIATE can wait up to busy_timeout for another worker's write
+    offload = True
+
+    def __init__(self, path: str, rate: float, burst: int, max_keys: int = 100_000, evict_probability: float = 0.01):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.evict_probability = evict_probability
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA busy_timeout = 5000")
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS RateLimits (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_rate_limits_updated ON RateLimits(updated);
+        ''')
+
+    def hit(self, key: str) -> float:
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                row = cursor.execute("SELECT tokens, updated FROM RateLimits WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (self.burst, now)
+                tokens = min(self.burst, tokens + max(now - updated, 0) * self.rate)
+                retry_after = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    retry_after = (1 - tokens) / self.rate
+                cursor.execute(
+                    "INSERT INTO RateLimits (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens, now),
+                )
+                if random.random() < self.evict_probability:
+                    self.evict(cursor, now)
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+        return retry_after
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def evict(self, cursor, now):
+        # a bucket untouched for burst / rate seconds is full again, same as a missing row
+        cursor.execute("DELETE FROM RateLimits WHERE updated < ?", (now - self.burst / self.rate,))
+        cursor.execute(
+            "DELETE FROM RateLimits WHERE key IN ("
+            "SELECT key FROM RateLimits ORDER BY updated "
+            "LIMIT max((SELECT count(*) FROM RateLimits) - ?, 0))",
+            (self.max_keys,),
+        )
+
+
+def create_limiter(rate: float, burst: int):
+    path = os.getenv("RATE_LIMIT_DB")
+    if path:
+        return SQLiteTokenBucketLimiter(path, rate, burst)
+    return TokenBucketLimiter(rate, burst)
+
+
+class LoginThrottle:
+    def __init__(self, username_limiter, ip_limiter):
+        self.username_limiter = username_limiter
+        self.ip_limiter = ip_limiter
+
+    async def check(self, request: Request, username: str):
+        client_ip = request.client.host if request.client else "unknown"
+        for limiter, key in ((self.ip_limiter, f"ip:{client_ip}"), (self.username_limiter, f"user:{username}")):
+            if limiter.offload:
+                retry_after = await asyncio.to_thread(limiter.hit, key)
+            else:
+                retry_after = limiter.hit(key)
+            if retry_after:
+                raise HTTPException(
+                    status.HTTP_429_TOO_MANY_REQUESTS,
+                    "Too many login attempts",
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+
+    def close(self):
+        self.username_limiter.close()
+        self.ip_limiter.close()
+
+
+def create_login_throttle():
+    return LoginThrottle(
+        username_limiter=create_limiter(
+            rate=float(os.getenv("LOGIN_USERNAME_RATE", 5 / 60)),
+            burst=int(os.getenv("LOGIN_USERNAME_BURST", 5)),
+        ),
+        ip_limiter=create_limiter(
+            rate=float(os.getenv("LOGIN_IP_RATE", 1)),
+            burst=int(os.getenv("LOGIN_IP_BURST", 20)),
+        ),
+    )
@@ -0,0 +1,45 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SingleFlight:
+    def __init__(self, name: str, max_workers: int = 4):
+        self.name = name
+        # its own threads, so a burst of distinct keys holds at most max_workers database connections
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.calls = {}
+        self.stats = {"executions": 0, "coalesced": 0, "raised": 0}
+
+    async def run(self, key, function, *args, offload: bool = True):
+        task = self.calls.get(key)
+        if task is None and not offload:
+            # a call that never blocks finishes before anyone else could join it
+            self.stats["executions"] += 1
+            try:
+                return function(*args)
+            except Exception:
+                self.stats["raised"] += 1
+                raise
+        if task is None:
+            # blocking reads run on a thread so that identical requests arriving meanwhile can join them
+            task = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+            task.add_done_callback(lambda done: self.finish(key, done))
+            self.calls[key] = task
+            self.stats["executions"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        # a waiter that disconnects must not cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    def finish(self, key, task):
+        del self.calls[key]
+        if task.cancelled() or task.exception() is not None:
+            self.stats["raised"] += 1
+
+    def metrics(self):
+        calls = self.stats["executions"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "in_flight": len(self.calls),
+            "coalesced_ratio": round(self.stats["coalesced"] / calls, 4) if calls else 0.0,
+        }
@@ -0,0 +1,67 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+
+
+class SQLitePool:
+    def __init__(self, path: str, size: int = 8, timeout: float = 5.0):
+        self.path = path
+        # enough for a SingleFlight's 4 threads plus the handlers that query from the event loop
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout)
+        # only takes effect on a new file, so db_maintenance can free pages without a full VACUUM
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.connections) < self.size:
+                connection = self.connect()
+                self.connections.append(connection)
+                return connection
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("connection pool exhausted")
+
+    async def acquire_async(self):
+        # handlers on the event loop must not sit in idle.get(); only a full pool waits, and on a thread
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        return await asyncio.to_thread(self.acquire)
+
+    def release(self, connection):
+        # whatever the handler left uncommitted is dropped, as closing the connection used to do
+        if connection.in_transaction:
+            connection.rollback()
+        connection.row_factory = None
+        self.idle.put(connection)
+
+    def execute_script(self, script: str):
+        connection = self.acquire()
+        try:
+            connection.executescript(script)
+        finally:
+            self.release(connection)
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections.clear()
+        self.idle = queue.LifoQueue()
@@ -2,6 +2,11 @@ from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import uvicorn
 import sqlite3
+from contextlib import asynccontextmanager
+from loopmonitor import install_from_env
+from sqlitepool import SQLitePool
+from http_compression import CompressionMiddleware
+from db_maintenance import DatabaseMaintenance, install as install_db_admin
 
 
 
@@ -18,26 +23,37 @@ class DeleteTask(BaseModel):
     id: int
 
 
-def init_db():
-    connection = sqlite3.connect('todo.db')
-    cursor = connection.cursor()
-    cursor.execute('''
+def init_db(db: SQLitePool):
+    db.execute_script('''
         CREATE TABLE IF NOT EXISTS Todolist (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
             description TEXT NOT NULL
-        )
+        );
     ''')
-    connection.commit()
-    connection.close()
 
-app = FastAPI(on_startup=[init_db])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.db = SQLitePool('todo.db')
+    init_db(app.state.db)
+    app.state.maintenance = DatabaseMaintenance('todo.db')
+    await app.state.maintenance.start()
+    try:
+        yield
+    finally:
+        await app.state.maintenance.close()
+        app.state.db.close()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
+install_db_admin(app)
 
 @app.post('/createtask/')
 async def create_task(task: Task):
     connection = None
     try:
-        connection = sqlite3.connect('todo.db')
+        connection = await app.state.db.acquire_async()
         cursor = connection.cursor()
 
         cursor.execute('''SELECT id FROM Todolist WHERE title = ?''',(task.title,))
@@ -55,7 +71,7 @@ async def create_task(task: Task):
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         if connection is not None:
-            connection.close()
+            app.state.db.release(connection)
 
     return {"message": f"Task '{task.title}' added"}
 
@@ -64,7 +80,7 @@ async def create_task(task: Task):
 async def edit_task(task: EditTask):
     conn = None
     try:
-        conn = sqlite3.connect('todo.db')
+        conn = await app.state.db.acquire_async()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM Todolist WHERE id = ?', (task.id,))
         tas = cursor.fetchone()
@@ -81,14 +97,14 @@ async def edit_task(task: EditTask):
 
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
 
 
 @app.delete('/deletetask/')
 async def delete_task(task:DeleteTask):
     conn = None
     try:
-        conn = sqlite3.connect('todo.db')
+        conn = await app.state.db.acquire_async()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM Todolist WHERE id = ?', (task.id,))
         one = cursor.fetchone()
@@ -104,7 +120,7 @@ async def delete_task(task:DeleteTask):
 
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
     return {"message": f"Task with id {task.id} deleted"}
 
 
@@ -112,7 +128,7 @@ async def delete_task(task:DeleteTask):
 async def one_task(id: int):
     conn = None
     try:
-        conn = sqlite3.connect('todo.db')
+        conn = await app.state.db.acquire_async()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM Todolist WHERE id = ?', (id,))
         row = cursor.fetchone()
@@ -132,14 +148,14 @@ async def one_task(id: int):
 
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
 
 
 @app.get('/tasks/')
 async def get_tasks():
     conn = None
     try:
-        conn = sqlite3.connect('todo.db')
+        conn = await app.state.db.acquire_async()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM Todolist')
         rows = cursor.fetchall()
@@ -166,7 +182,11 @@ async def get_tasks():
 
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
+
+
+install_from_env(app)
+
 
 if __name__ == "__main__":
     uvicorn.run("todo:app", reload=True)
\ No newline at end of file
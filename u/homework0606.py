@@ -3,20 +3,26 @@ from pydantic import BaseModel, Field, EmailStr
 import uvicorn
 from typing import List
 import sqlite3
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
 
-def init_db():
-    connection = sqlite3.connect('products.db')
-    cursor = connection.cursor()
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from sqlitepool import SQLitePool
+from singleflight import SingleFlight
+from http_compression import CompressionMiddleware
+from db_maintenance import DatabaseMaintenance, install as install_db_admin
+from loopmonitor import install_from_env
 
-    cursor.execute('''
+
+def init_db(db: SQLitePool):
+    db.execute_script('''
         CREATE TABLE IF NOT EXISTS Users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
             email TEXT NOT NULL UNIQUE
-        )
-    ''')
+        );
 
-    cursor.execute('''
         CREATE TABLE IF NOT EXISTS Orders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
@@ -24,13 +30,26 @@ def init_db():
             amount INTEGER NOT NULL CHECK(amount > 0),
             price FLOAT NOT NULL CHECK(price >= 0),
             FOREIGN KEY(user_id) REFERENCES Users(id) ON DELETE CASCADE
-        )
+        );
     ''')
 
-    connection.commit()
-    connection.close()
 
-app = FastAPI(on_startup=[init_db])
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.db = SQLitePool('products.db')
+    init_db(app.state.db)
+    app.state.maintenance = DatabaseMaintenance('products.db')
+    await app.state.maintenance.start()
+    try:
+        yield
+    finally:
+        await app.state.maintenance.close()
+        app.state.db.close()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
+install_db_admin(app)
+user_flights = SingleFlight("get_user")
 
 class Order(BaseModel):
     product_name: str = Field(..., description="Назва продукту")
@@ -47,7 +66,7 @@ class User(BaseModel):
 async def create_user(user: User):
     conn = None
     try:
-        conn = sqlite3.connect('products.db')
+        conn = await app.state.db.acquire_async()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
@@ -86,14 +105,13 @@ async def create_user(user: User):
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
 
 
-@app.get("/get_user")
-async def get_user(email: str):
+def load_user(email: str):
     conn = None
     try:
-        conn = sqlite3.connect('products.db')
+        conn = app.state.db.acquire()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
@@ -127,7 +145,20 @@ async def get_user(email: str):
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         if conn is not None:
-            conn.close()
+            app.state.db.release(conn)
+
+
+@app.get("/get_user")
+async def get_user(email: str):
+    return await user_flights.run(email, load_user, email)
+
+
+@app.get("/metrics/singleflight")
+async def singleflight_metrics():
+    return {"get_user": user_flights.metrics()}
+
+
+install_from_env(app)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
 import uvicorn
 import aiosqlite
-from fastapi import Depends, FastAPI, HTTPException, status
+import sys
+from pathlib import Path
+from fastapi import Depends, FastAPI, HTTPException, Request, status
 from fastapi.security import (
     HTTPBasic,
     OAuth2PasswordBearer,
@@ -8,15 +10,49 @@ from fastapi.security import (
     HTTPBasicCredentials
 )
 from pydantic import BaseModel, EmailStr, SecretStr, Field
+from functools import lru_cache
 import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from contextlib import asynccontextmanager
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from rate_limit import create_login_throttle
+from loopmonitor import install_from_env
 
 
-app = FastAPI(description="API with OAuth2 and HTTP Basic",)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.login_throttle = create_login_throttle()
+    try:
+        yield
+    finally:
+        app.state.login_throttle.close()
+
+
+app = FastAPI(description="API with OAuth2 and HTTP Basic", lifespan=lifespan)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 security = HTTPBasic()
 
 
+logger = logging.getLogger(__name__)
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+if not SECRET_KEY:
+    # a random key is per process: with several workers a token signed by one is rejected by the others
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        raise RuntimeError("SECRET_KEY must be set when running more than one worker")
+    logger.warning("SECRET_KEY is not set, signing tokens with a random key that changes on every restart")
+    SECRET_KEY = secrets.token_hex(32)
+SECRET_KEY = SECRET_KEY.encode("utf-8")
+TOKEN_TTL_SECONDS = 30 * 60
+
 users = {
     "andrii": {
         "name": "andrii",
@@ -25,6 +61,8 @@ users = {
     }
 }
 
+users_by_email = {user["email"]: user for user in users.values()}
+
 class Token(BaseModel):
 
     token_type: str = Field(description="type of the token", examples=["bearer"])
@@ -48,36 +86,55 @@ class UserShow(UserCreate):
           responses={
               200:{"description":"Success"},
               404: {"Description":"User not found"},
-              400:{"Description":"Incorrect password"}
+              400:{"Description":"Incorrect password"},
+              429:{"Description":"Too many login attempts"}
           },
           operation_id="get-access-token",
           include_in_schema=True,
           name="get_token")
-async def login( form_data: OAuth2PasswordRequestForm = Depends(),):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(),):
+    await request.app.state.login_throttle.check(request, form_data.username)
     if users is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User does not exist.")
 
     user_data = users.get(form_data.username)
-    if user_data:
-        if user_data["password"] != form_data.password:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Incorrect password.")
+    if not user_data:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "User does not exist.")
+    if user_data["password"] != form_data.password:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Incorrect password.")
 
-    token_value = base64.urlsafe_b64encode(
-        f"{user_data['email']}-{user_data['name']}".encode("utf-8")
-    ).decode("utf-8")
+    return Token(access_token=create_token(user_data), token_type="bearer")
 
-    return Token(access_token=token_value, token_type="bearer")
 
-async def decode_token(token: str):
-    try:
+def sign(payload: bytes):
+    return base64.urlsafe_b64encode(hmac.new(SECRET_KEY, payload, hashlib.sha256).digest())
 
-        decoded_user_email = (
-            base64.urlsafe_b64decode(token).split(b"-")[0].decode("utf-8")
-        )
-    except (UnicodeDecodeError, ValueError):
+
+def create_token(user: dict, ttl: int = TOKEN_TTL_SECONDS):
+    claims = {"email": user["email"], "name": user["name"], "exp": int(time.time()) + ttl}
+    payload = base64.urlsafe_b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload.decode('utf-8')}.{sign(payload).decode('utf-8')}"
+
+
+@lru_cache(maxsize=4096)
+def verify_signature(token: str):
+    try:
+        payload, signature = token.encode("utf-8").split(b".")
+    except ValueError:
+        return None
+    if not hmac.compare_digest(sign(payload), signature):
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(payload))
+    except ValueError:
         return None
 
-    return decoded_user_email
+
+async def decode_token(token: str):
+    claims = verify_signature(token)
+    if claims is None or claims["exp"] < time.time():
+        return None
+    return claims["email"]
 
 @app.get("/me", summary="Отримати інформацію про користувача",
          description="Повертає email та ім'я користувача на основі переданого access токена.",
@@ -90,11 +147,10 @@ async def get_user_me(token: str = Depends(oauth2_scheme)):
     if not email:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    for user in users.values():
-        if user["email"] == email:
-            return {"email": email, "name": user["name"]}
-
-    raise HTTPException(status_code=404, detail="User not found")
+    user = users_by_email.get(email)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"email": email, "name": user["name"]}
 
 
 
@@ -104,8 +160,10 @@ async def get_user_me(token: str = Depends(oauth2_scheme)):
     responses={
         200: {"description": "Успішний логін"},
         401: {"description": "Невірні дані"},
+        429: {"description": "Забагато спроб входу"},
     })
-async def basic(credentials: HTTPBasicCredentials = Depends(security)):
+async def basic(request: Request, credentials: HTTPBasicCredentials = Depends(security)):
+    await request.app.state.login_throttle.check(request, credentials.username)
     user = users.get(credentials.username)
     if not user or user["password"] != credentials.password:
         raise HTTPException(
@@ -115,6 +173,8 @@ async def basic(credentials: HTTPBasicCredentials = Depends(security)):
     return {"message": f"Hello, {credentials.username}!"}
 
 
+install_from_env(app)
+
 
 if __name__ == "__main__":
     uvicorn.run("oauthhomework:app", reload=True)
\ No newline at end of file